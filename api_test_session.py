@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+API测试脚本共用的HTTP会话和响应解析
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 可选：orjson加速成功响应的JSON解析
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 所有请求共享同一个会话，复用到API服务器的长连接
+# 服务器尚未就绪时自动退避重试：连接失败对所有请求重试，502/503/504只重试GET等幂等请求
+SESSION = requests.Session()
+SESSION.mount('http://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=5, backoff_factor=0.1, status_forcelist=[502, 503, 504], raise_on_status=False)
+))
+
+def load_json(response):
+    """解析成功响应的JSON，安装了orjson时使用orjson"""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
@@ -4,26 +4,48 @@ Mapperatorinator API - 重构版本
 """
 
 import asyncio
+import bisect
+import codecs
+import io
+import itertools
 import json
 import os
-import subprocess
+import re
+import shutil
 import sys
 import threading
 import time
 import uuid
 import glob
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, fields
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple, BinaryIO
+from urllib.parse import quote
 
 try:
     import uvicorn
-    from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+    from fastapi import Depends, FastAPI, File, Form, HTTPException, Request, UploadFile, WebSocket, WebSocketDisconnect
     from fastapi.middleware.cors import CORSMiddleware
-    from fastapi.responses import FileResponse
+    from fastapi.responses import FileResponse, Response
     from pydantic import BaseModel, Field
     from sse_starlette.sse import EventSourceResponse
     import redis
     import redis.exceptions
+    # 可选：orjson加速JSON编解码
+    try:
+        import orjson
+        from fastapi.responses import ORJSONResponse as DefaultJSONResponse
+    except ImportError:
+        orjson = None
+        from fastapi.responses import JSONResponse as DefaultJSONResponse
+        print("💡 提示：安装orjson可加速JSON响应: pip install orjson")
+    # 可选：pyahocorasick一次扫描匹配全部阶段关键词
+    try:
+        import ahocorasick
+    except ImportError:
+        ahocorasick = None
     # 可选：加载.env文件
     try:
         from dotenv import load_dotenv
@@ -38,12 +60,33 @@ except ImportError as e:
 
 from config import InferenceConfig
 
+@dataclass(slots=True)
+class JobMeta:
+    """任务元数据"""
+    audio_path: str
+    audio_filename: Optional[str]
+    start_time: float
+    params: Dict[str, Any] = field(default_factory=dict)
+    pid: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "JobMeta":
+        """从缓存字典恢复，忽略未知字段"""
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in names})
+
 # 全局变量
-active_processes: Dict[str, subprocess.Popen] = {}
-process_outputs: Dict[str, List[str]] = {}
-job_metadata: Dict[str, Dict] = {}
+active_processes: Dict[str, asyncio.subprocess.Process] = {}
+process_outputs: Dict[str, deque] = {}  # 每个任务最近的输出行（环形缓冲）
+output_line_counts: Dict[str, int] = {}  # 每个任务累计输出的行数
+job_metadata: Dict[str, JobMeta] = {}
 job_progress: Dict[str, Dict] = {}  # 新增进度追踪
-process_lock = threading.Lock()
+job_locks: Dict[str, threading.Lock] = {}  # 每个任务独立的进度锁
+process_lock = threading.Lock()  # 仅用于任务的创建和删除
+_background_tasks: set = set()  # 持有监控任务的引用，防止被垃圾回收
+_finished_queue: deque = deque()  # 进程已结束、待从active_processes移除的任务
+_completion_queue: deque = deque()  # (job_id, 完成时间)，按完成顺序排列，用于过期清理
+_inference_queue: deque = deque()  # 等待推理名额的任务，按提交顺序排列
 
 # Redis连接 - 使用db1
 redis_client = None
@@ -70,12 +113,56 @@ OUTPUTS = Path("outputs")              # 输出目录
 AUDIO_STORAGE.mkdir(exist_ok=True)
 OUTPUTS.mkdir(exist_ok=True)
 
+# 支持的音频格式
+AUDIO_EXTENSIONS = frozenset({'.mp3', '.wav', '.ogg', '.m4a', '.flac'})
+
+# 上传文件分块写入磁盘的块大小
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 1 << 20))
+
+# 分块上传：客户端使用的分块大小（也是单个分块的上限）、分块数量上限、未完成会话的保留时间
+UPLOAD_PART_SIZE = 8 << 20
+MAX_UPLOAD_PARTS = 10000
+UPLOAD_SESSION_TTL = 3600
+
+# 分块上传会话 {upload_id: {"filename", "file_ext", "params", "created_at"}}
+_uploads: Dict[str, Dict[str, Any]] = {}
+
+# 默认线程池大小，用于上传读取等阻塞操作
+THREAD_POOL_SIZE = int(os.getenv('THREAD_POOL_SIZE', 64))
+
+# 同时运行的推理进程数，超出的任务排队等待，避免突发请求耗尽显存/CPU
+INFERENCE_CONCURRENCY = max(1, int(os.getenv('INFERENCE_CONCURRENCY', 1)))
+_inference_semaphore = asyncio.Semaphore(INFERENCE_CONCURRENCY)
+
+# 每个任务在内存中保留的最近输出行数
+MAX_OUTPUT_LINES = 1000
+
+# 下载结果文件时每次读取/发送的块大小
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# 子进程输出每次读取的字节数，以及流式端点等待新输出的间隔
+OUTPUT_READ_SIZE = 64 * 1024
+OUTPUT_POLL_INTERVAL = 0.2
+
+# 轮询端点的已序列化响应缓存 {缓存键: (响应内容, JSON字节)}
+_response_cache: Dict[str, tuple] = {}
+
+# 输出目录不存在的负缓存 {job_id: 检查时间}，避免404请求反复访问文件系统
+_missing_dirs: Dict[str, float] = {}
+MISSING_DIR_TTL = 5.0
+
+# 输出文件列表的短期本地缓存 {job_id: (缓存时间, 文件列表)}，避免轮询时反复遍历目录
+_files_cache: Dict[str, Tuple[float, List[str]]] = {}
+_listing_cache: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+FILES_CACHE_TTL = 2.0
+
 app = FastAPI(
     title="Mapperatorinator API",
     description="AI生成osu! beatmap的API接口",
     version="2.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=DefaultJSONResponse
 )
 
 # CORS中间件
@@ -87,12 +174,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# JSON编解码辅助函数，安装了orjson时使用orjson
+def json_dumps_bytes(value: Any) -> bytes:
+    """紧凑JSON编码为UTF-8字节"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def json_dumps(value: Any) -> str:
+    """紧凑JSON编码为字符串"""
+    return json_dumps_bytes(value).decode("utf-8")
+
+def json_loads(data: Any) -> Any:
+    """解析JSON，解析失败时抛出json.JSONDecodeError（orjson的异常是其子类）"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 # Redis缓存辅助函数
 def cache_set(key: str, value: Any, expire: int = 3600):
     """设置缓存，默认1小时过期"""
     if redis_client:
         try:
-            redis_client.setex(key, expire, json.dumps(value))
+            redis_client.setex(key, expire, json_dumps(value))
             return True
         except redis.exceptions.RedisError as e:
             print(f"Redis设置失败: {e}")
@@ -104,7 +208,7 @@ def cache_get(key: str) -> Optional[Any]:
         try:
             data = redis_client.get(key)
             if data and isinstance(data, (str, bytes)):
-                return json.loads(data)
+                return json_loads(data)
             return None
         except (redis.exceptions.RedisError, json.JSONDecodeError) as e:
             print(f"Redis获取失败: {e}")
@@ -148,9 +252,7 @@ def cache_job_metadata(job_id: str):
     """缓存任务元数据"""
     metadata = job_metadata.get(job_id)
     if metadata:
-        # 移除不能序列化的对象
-        serializable_metadata = {k: v for k, v in metadata.items() if k != 'process'}
-        cache_set(f"job_metadata:{job_id}", serializable_metadata, 7200)
+        cache_set(f"job_metadata:{job_id}", asdict(metadata), 7200)
 
 def get_cached_job_metadata(job_id: str) -> Optional[Dict]:
     """获取缓存的任务元数据"""
@@ -187,6 +289,7 @@ class ProgressResponse(BaseModel):
     estimated: bool = Field(..., description="是否为估算进度")
     last_update: float = Field(..., description="最后更新时间戳")
     status: str = Field(..., description="任务状态")
+    queue_position: Optional[int] = Field(None, description="排队位置 (1表示下一个运行)，未排队时为空")
 
 class JobStatus(BaseModel):
     """任务状态模型"""
@@ -197,22 +300,154 @@ class JobStatus(BaseModel):
     output_files: Optional[List[str]] = Field(None, description="输出文件列表")
     error: Optional[str] = Field(None, description="错误信息")
 
+class ChunkedFileResponse(FileResponse):
+    """以更大的块发送文件（Starlette默认64KB），减少大.osz文件下载时的读写次数"""
+    chunk_size = DOWNLOAD_CHUNK_SIZE
+
+def cached_json_response(cache_key: str, payload: Dict[str, Any]) -> Response:
+    """返回JSON响应，内容未变化时直接复用上次序列化的字节，跳过Pydantic校验和编码"""
+    cached = _response_cache.get(cache_key)
+    if cached and cached[0] == payload:
+        body = cached[1]
+    else:
+        body = json_dumps_bytes(payload)
+        _response_cache[cache_key] = (payload, body)
+    return Response(content=body, media_type="application/json")
+
+def job_status_response(job_id: str, status: str, message: Optional[str] = None,
+                        progress: Optional[float] = None, output_files: Optional[List[str]] = None,
+                        error: Optional[str] = None) -> Response:
+    """构建JobStatus格式的响应"""
+    return cached_json_response(f"status:{job_id}", {
+        "job_id": job_id,
+        "status": status,
+        "message": message,
+        "progress": progress,
+        "output_files": output_files,
+        "error": error
+    })
+
+def progress_response(job_id: str, progress: float, stage: str, estimated: bool,
+                      last_update: float, status: str, queue_position: Optional[int] = None) -> Response:
+    """构建ProgressResponse格式的响应"""
+    return cached_json_response(f"progress:{job_id}", {
+        "job_id": job_id,
+        "progress": float(progress),
+        "stage": stage,
+        "estimated": estimated,
+        "last_update": float(last_update),
+        "status": status,
+        "queue_position": queue_position
+    })
+
+# tqdm进度条格式：匹配 "数字%|进度条| 数字/总数" 或 "数字%|"（按优先级排列，模块加载时预编译，
+# 分组数直接读取编译后模式的 groups 属性，不必为每次匹配构造分组元组）
+_TQDM_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    r'^\s*(\d+)%\|.*?\|\s*(\d+)/(\d+)',  # 完整tqdm: "  0%|          | 0/65"
+    r'^\s*(\d+)%\|',                     # 简化tqdm: "  0%|"
+    r'(\d+)%\|.*?\|\s*(\d+)/(\d+)',      # 行中的tqdm格式
+))
+
+# 备用模式：其他常见进度格式
+_BACKUP_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'(\d+)%(?!\|)',                    # 简单百分比: 50% (但不是 50%|)
+    r'(\d+)/(\d+)',                     # 分数格式: 50/100
+    r'Progress:\s*(\d+(?:\.\d+)?)%',    # Progress: 50.5%
+    r'(\d+(?:\.\d+)?)%\s*complete',     # 50.5% complete
+    r'Step\s+(\d+)\s+of\s+(\d+)',       # Step 5 of 10
+    r'Processing.*?(\d+)%',             # Processing... 50%
+    r'Generating.*?(\d+)%',             # Generating... 50%
+))
+
+# 基于实际inference.py输出的关键词 -> (阶段名, 起始进度, 结束进度)
+# 起止进度为None表示保持当前进度（错误阶段）
+_STAGE_KEYWORDS = {
+    # 实际观察到的关键词（从用户提供的输出）
+    "using cuda for inference": ("initializing", 0, 5),
+    "using mps for inference": ("initializing", 0, 5),
+    "using cpu for inference": ("initializing", 0, 5),
+    "random seed": ("loading_model", 5, 10),
+    "model loaded": ("model_ready", 10, 15),
+    "generating map": ("generating_map", 15, 85),
+    "generating timing": ("generating_timing", 15, 40),
+    "generating kiai": ("generating_kiai", 40, 60),
+    "generated beatmap saved": ("saving", 85, 95),
+    "generated .osz saved": ("completed", 95, 100),
+    
+    # web-ui.js中的progressTitles对应关键词
+    "seq len": ("refining_positions", 85, 95),
+    
+    # 其他可能的关键词
+    "loading": ("loading", 0, 10),
+    "load": ("loading", 0, 10),
+    "initializing": ("initializing", 0, 5),
+    "preprocessing": ("preprocessing", 5, 15),
+    "processing": ("processing", 10, 50),
+    "inference": ("inference", 30, 80),
+    "generating": ("generating", 40, 85),
+    "postprocessing": ("postprocessing", 85, 95),
+    "saving": ("saving", 95, 100),
+    "export": ("export", 95, 100),
+    "complete": ("completed", 100, 100),
+    "finished": ("completed", 100, 100),
+    "done": ("completed", 100, 100),
+    
+    # 模型相关关键词
+    "model": ("loading", 0, 10),
+    "tokenizer": ("loading", 5, 15),
+    "config": ("loading", 0, 10),
+    "checkpoint": ("loading", 5, 15),
+    
+    # 音频处理关键词
+    "audio": ("preprocessing", 10, 25),
+    "spectrogram": ("preprocessing", 15, 30),
+    "feature": ("preprocessing", 20, 35),
+    
+    # CUDA/设备关键词
+    "cuda": ("initializing", 0, 5),
+    "device": ("initializing", 0, 5),
+    "gpu": ("initializing", 0, 5),
+    
+    # 错误关键词
+    "error": ("error", None, None),
+    "failed": ("error", None, None),
+    "exception": ("error", None, None),
+    "traceback": ("error", None, None),
+}
+
+# 时间估算时进度增长较慢的生成阶段，以及增长较快的加载阶段
+_GENERATION_STAGES = frozenset({'generating_map', 'generating_timing', 'generating_kiai', 'inference', 'generating'})
+_LOADING_STAGES = frozenset({'loading', 'initializing'})
+
+# 基于经验的任务总时长估算（假设一般任务需要2-5分钟），用于时间估算进度
+ESTIMATED_TOTAL_TIME = 180
+
+# 按关键词长度降序排列，第一个命中即为最具体的匹配（同长度保持原有顺序）
+_STAGE_KEYWORDS_BY_LENGTH = tuple(sorted(_STAGE_KEYWORDS.items(), key=lambda item: -len(item[0])))
+
+# 快速预筛：进度模式都需要 "%"、"/" 或 "of"；阶段关键词合并为一个正则，未命中时跳过逐个扫描
+_PROGRESS_MARKERS = ('%', '/')
+_STAGE_FASTPATH = re.compile('|'.join(re.escape(keyword) for keyword in _STAGE_KEYWORDS))
+
+# 安装了pyahocorasick时，用自动机一次扫描找出行中出现的全部关键词，值为 (优先级序号, 阶段信息)
+_STAGE_AUTOMATON = None
+if ahocorasick is not None:
+    _STAGE_AUTOMATON = ahocorasick.Automaton()
+    for _order, (_keyword, _stage_info) in enumerate(_STAGE_KEYWORDS_BY_LENGTH):
+        _STAGE_AUTOMATON.add_word(_keyword, (_order, _stage_info))
+    _STAGE_AUTOMATON.make_automaton()
+
 def parse_progress_from_output(output_line: str) -> Optional[float]:
     """从输出行解析进度百分比 - 支持tqdm和其他进度格式"""
-    import re
-    
-    # tqdm进度条格式：匹配 "数字%|进度条| 数字/总数" 或 "数字%|"
-    tqdm_patterns = [
-        r'^\s*(\d+)%\|.*?\|\s*(\d+)/(\d+)',  # 完整tqdm: "  0%|          | 0/65"
-        r'^\s*(\d+)%\|',                     # 简化tqdm: "  0%|"
-        r'(\d+)%\|.*?\|\s*(\d+)/(\d+)',      # 行中的tqdm格式
-    ]
+    # 大多数输出行不含进度信息，先用子串检查跳过正则匹配
+    if not any(marker in output_line for marker in _PROGRESS_MARKERS) and 'of' not in output_line.lower():
+        return None
     
-    for pattern in tqdm_patterns:
-        match = re.search(pattern, output_line)
+    for pattern in _TQDM_PATTERNS:
+        match = pattern.search(output_line)
         if match:
             try:
-                if len(match.groups()) == 3:
+                if pattern.groups == 3:
                     # 完整格式，使用分数计算更精确的进度
                     percent_display = float(match.group(1))
                     current = float(match.group(2))
@@ -230,26 +465,15 @@ def parse_progress_from_output(output_line: str) -> Optional[float]:
             except ValueError:
                 continue
     
-    # 备用模式：其他常见进度格式
-    backup_patterns = [
-        r'(\d+)%(?!\|)',                    # 简单百分比: 50% (但不是 50%|)
-        r'(\d+)/(\d+)',                     # 分数格式: 50/100
-        r'Progress:\s*(\d+(?:\.\d+)?)%',    # Progress: 50.5%
-        r'(\d+(?:\.\d+)?)%\s*complete',     # 50.5% complete
-        r'Step\s+(\d+)\s+of\s+(\d+)',       # Step 5 of 10
-        r'Processing.*?(\d+)%',             # Processing... 50%
-        r'Generating.*?(\d+)%',             # Generating... 50%
-    ]
-    
-    for pattern in backup_patterns:
-        match = re.search(pattern, output_line, re.IGNORECASE)
+    for pattern in _BACKUP_PATTERNS:
+        match = pattern.search(output_line)
         if match:
             try:
-                if len(match.groups()) == 1:
+                if pattern.groups == 1:
                     # 直接百分比
                     percent = float(match.group(1))
                     return min(100.0, max(0.0, percent))
-                elif len(match.groups()) == 2:
+                elif pattern.groups == 2:
                     # 分数格式，计算百分比
                     current = float(match.group(1))
                     total = float(match.group(2))
@@ -263,77 +487,27 @@ def parse_progress_from_output(output_line: str) -> Optional[float]:
 
 def estimate_progress_from_stage(output_line: str, current_progress: float) -> Optional[Dict[str, Any]]:
     """根据处理阶段估算进度 - 参考web-ui.js的阶段识别"""
-    
-    # 基于实际inference.py输出的关键词
-    stage_keywords = {
-        # 实际观察到的关键词（从用户提供的输出）
-        "using cuda for inference": ("initializing", 0, 5),
-        "using mps for inference": ("initializing", 0, 5),
-        "using cpu for inference": ("initializing", 0, 5),
-        "random seed": ("loading_model", 5, 10),
-        "model loaded": ("model_ready", 10, 15),
-        "generating map": ("generating_map", 15, 85),
-        "generating timing": ("generating_timing", 15, 40),
-        "generating kiai": ("generating_kiai", 40, 60),
-        "generated beatmap saved": ("saving", 85, 95),
-        "generated .osz saved": ("completed", 95, 100),
-        
-        # web-ui.js中的progressTitles对应关键词
-        "seq len": ("refining_positions", 85, 95),
-        
-        # 其他可能的关键词
-        "loading": ("loading", 0, 10),
-        "load": ("loading", 0, 10),
-        "initializing": ("initializing", 0, 5),
-        "preprocessing": ("preprocessing", 5, 15),
-        "processing": ("processing", 10, 50),
-        "inference": ("inference", 30, 80),
-        "generating": ("generating", 40, 85),
-        "postprocessing": ("postprocessing", 85, 95),
-        "saving": ("saving", 95, 100),
-        "export": ("export", 95, 100),
-        "complete": ("completed", 100, 100),
-        "finished": ("completed", 100, 100),
-        "done": ("completed", 100, 100),
-        
-        # 模型相关关键词
-        "model": ("loading", 0, 10),
-        "tokenizer": ("loading", 5, 15),
-        "config": ("loading", 0, 10),
-        "checkpoint": ("loading", 5, 15),
-        
-        # 音频处理关键词
-        "audio": ("preprocessing", 10, 25),
-        "spectrogram": ("preprocessing", 15, 30),
-        "feature": ("preprocessing", 20, 35),
-        
-        # CUDA/设备关键词
-        "cuda": ("initializing", 0, 5),
-        "device": ("initializing", 0, 5),
-        "gpu": ("initializing", 0, 5),
-        
-        # 错误关键词
-        "error": ("error", current_progress, current_progress),
-        "failed": ("error", current_progress, current_progress),
-        "exception": ("error", current_progress, current_progress),
-        "traceback": ("error", current_progress, current_progress),
-    }
-    
     line_lower = output_line.lower()
     
-    # 查找最佳匹配的关键词
+    # 查找最佳匹配的关键词（优先选择更长、更具体的关键词）
     best_match = None
-    best_keyword_len = 0
-    
-    for keyword, (stage_name, start, end) in stage_keywords.items():
-        if keyword in line_lower:
-            # 优先选择更长的关键词匹配（更具体）
-            if len(keyword) > best_keyword_len:
-                best_match = (stage_name, start, end)
-                best_keyword_len = len(keyword)
+    if _STAGE_AUTOMATON is not None:
+        hit = min(_STAGE_AUTOMATON.iter(line_lower), key=lambda item: item[1][0], default=None)
+        if hit is None:
+            return None
+        best_match = hit[1][1]
+    else:
+        if not _STAGE_FASTPATH.search(line_lower):
+            return None
+        for keyword, stage_info in _STAGE_KEYWORDS_BY_LENGTH:
+            if keyword in line_lower:
+                best_match = stage_info
+                break
     
     if best_match:
         stage_name, start, end = best_match
+        if start is None:
+            start = end = current_progress
         # 如果检测到新阶段，更新进度到该阶段的开始点
         if current_progress < start:
             return {
@@ -358,14 +532,34 @@ def estimate_progress_from_stage(output_line: str, current_progress: float) -> O
     
     return None
 
+def restore_job_progress(job_id: str, progress_info: Dict):
+    """从缓存恢复任务进度，已完成的任务加入过期清理队列"""
+    job_progress[job_id] = progress_info
+    completed_at = progress_info.get('completed_at')
+    if completed_at:
+        # 恢复的任务可能早于队列中已有的任务完成，按完成时间插入以保持队列有序
+        bisect.insort(_completion_queue, (job_id, completed_at), key=lambda entry: entry[1])
+
+def mark_job_finished(job_id: str, completed_at: float):
+    """记录任务结束，供定期清理按队列处理而无需扫描所有任务"""
+    _finished_queue.append(job_id)
+    _completion_queue.append((job_id, completed_at))
+
+def get_job_lock(job_id: str) -> threading.Lock:
+    """获取任务的进度锁，不同任务之间互不阻塞"""
+    lock = job_locks.get(job_id)
+    if lock is None:
+        lock = job_locks.setdefault(job_id, threading.Lock())
+    return lock
+
 def update_job_progress(job_id: str, output_line: str):
     """更新任务进度 - 参考web-ui.py的进度解析逻辑，支持Redis缓存"""
-    with process_lock:
+    with get_job_lock(job_id):
         if job_id not in job_progress:
             # 尝试从缓存加载进度信息
             cached_progress = get_cached_job_progress(job_id)
             if cached_progress:
-                job_progress[job_id] = cached_progress
+                restore_job_progress(job_id, cached_progress)
             else:
                 job_progress[job_id] = {
                     'progress': 0.0,
@@ -374,8 +568,9 @@ def update_job_progress(job_id: str, output_line: str):
                     'estimated': False
                 }
         
-        current_progress = job_progress[job_id]['progress']
-        current_stage = job_progress[job_id]['stage']
+        progress_info = job_progress[job_id]
+        current_progress = progress_info['progress']
+        current_stage = progress_info['stage']
         
         # 首先尝试从输出中解析精确进度（主要是匹配 "数字%|" 格式）
         parsed_progress = parse_progress_from_output(output_line)
@@ -412,17 +607,17 @@ def update_job_progress(job_id: str, output_line: str):
         # 更积极的时间估算策略
         if elapsed > 5:  # 每5秒检查一次
             # 根据任务运行总时间估算进度
-            total_elapsed = time.time() - job_metadata.get(job_id, {}).get('start_time', time.time())
+            metadata = job_metadata.get(job_id)
+            total_elapsed = time.time() - metadata.start_time if metadata else 0.0
             
-            # 基于经验的时间估算（假设一般任务需要2-5分钟）
-            estimated_total_time = 180  # 3分钟的估算
-            time_based_progress = min(90.0, (total_elapsed / estimated_total_time) * 100)
+            # 基于经验的时间估算
+            time_based_progress = min(90.0, (total_elapsed / ESTIMATED_TOTAL_TIME) * 100)
             
             # 根据当前阶段决定增长速度
-            if current_stage in ['generating_map', 'generating_timing', 'generating_kiai', 'inference', 'generating']:
+            if current_stage in _GENERATION_STAGES:
                 # 生成阶段进度较慢，每次增加小幅度
                 increment = min(2.0, (100 - current_progress) * 0.08)
-            elif current_stage in ['loading', 'initializing']:
+            elif current_stage in _LOADING_STAGES:
                 # 加载阶段相对较快
                 increment = min(5.0, (30 - current_progress) * 0.2)
             else:
@@ -463,119 +658,254 @@ def parse_optional_float(value: str) -> Optional[float]:
     except ValueError:
         return None
 
-def save_audio_file(file: UploadFile, job_id: str) -> str:
-    """保存音频文件到固定目录"""
-    # 验证文件类型
-    valid_extensions = {'.mp3', '.wav', '.ogg', '.m4a', '.flac'}
-    if not file.filename:
+def audio_file_extension(filename: Optional[str]) -> str:
+    """验证音频文件类型，返回小写扩展名"""
+    if not filename:
         raise HTTPException(status_code=400, detail="没有提供文件")
     
-    file_ext = Path(file.filename).suffix.lower()
-    if file_ext not in valid_extensions:
+    _, dot, ext = filename.rpartition(".")
+    file_ext = f".{ext.lower()}" if dot else ""
+    if file_ext not in AUDIO_EXTENSIONS:
         raise HTTPException(
             status_code=400, 
-            detail=f"不支持的文件类型。支持的格式: {', '.join(valid_extensions)}"
+            detail=f"不支持的文件类型。支持的格式: {', '.join(sorted(AUDIO_EXTENSIONS))}"
         )
+    return file_ext
+
+def job_audio_path(job_id: str, file_ext: str) -> str:
+    """任务音频文件的存储路径，使用job_id作为文件名"""
+    return os.path.abspath(os.path.join(AUDIO_STORAGE, f"{job_id}{file_ext}"))
+
+def open_audio_file(file: UploadFile, job_id: str) -> Tuple[str, BinaryIO]:
+    """验证音频文件类型，并在固定目录中打开目标文件用于写入，返回(路径, 文件句柄)"""
+    audio_path = job_audio_path(job_id, audio_file_extension(file.filename))
+    return audio_path, open(audio_path, "wb")
+
+def assemble_upload_parts(part_paths: List[Path], audio_path: str):
+    """按顺序把分块文件拼接为完整的音频文件"""
+    with open(audio_path, "wb") as output:
+        for part_path in part_paths:
+            with open(part_path, "rb") as part:
+                shutil.copyfileobj(part, output, UPLOAD_CHUNK_SIZE)
+
+def output_dir_exists(job_id: str) -> bool:
+    """检查任务输出目录是否存在，不存在的结果缓存几秒"""
+    now = time.time()
+    checked_at = _missing_dirs.get(job_id)
+    if checked_at is not None and now - checked_at < MISSING_DIR_TTL:
+        return False
     
-    # 使用job_id作为文件名
-    audio_filename = f"{job_id}{file_ext}"
-    audio_path = AUDIO_STORAGE / audio_filename
+    if (OUTPUTS / job_id).exists():
+        _missing_dirs.pop(job_id, None)
+        return True
     
-    return str(audio_path.absolute())
+    _missing_dirs[job_id] = now
+    return False
+
+# Hydra参数引用：用单引号包裹，并转义值中的单引号
+_SQ = "'"
+_ESC_SQ = "\\'"
+
+# 需要引用的路径参数
+_PATH_PARAMS = frozenset({"audio_path", "output_path", "beatmap_path"})
+
+# 按命令行顺序排列的可选参数 (参数名, 默认值)
+_PARAM_SPECS = (
+    # 可选参数
+    ("gamemode", 0),
+    ("difficulty", None),
+    ("year", None),
+    ("mapper_id", None),
+    # 难度设置
+    ("hp_drain_rate", None),
+    ("circle_size", None),
+    ("overall_difficulty", None),
+    ("approach_rate", None),
+    ("slider_multiplier", None),
+    ("slider_tick_rate", None),
+    # Mania专用
+    ("keycount", None),
+    ("hold_note_ratio", None),
+    ("scroll_speed_ratio", None),
+    # 生成设置
+    ("cfg_scale", 1.0),
+    ("temperature", 1.0),
+    ("top_p", 0.95),
+    ("seed", None),
+    # 时间设置
+    ("start_time", None),
+    ("end_time", None),
+)
+
+# 布尔选项 (参数名, 默认值)
+_BOOL_PARAM_SPECS = (
+    ("export_osz", True),
+    ("add_to_beatmap", False),
+    ("hitsounded", False),
+    ("super_timing", False),
+)
+
+# 列表参数
+_LIST_PARAMS = ("descriptors", "negative_descriptors")
+
+def hydra_quote(value) -> str:
+    """Hydra参数引用"""
+    return f"{_SQ}{str(value).replace(_SQ, _ESC_SQ)}{_SQ}"
+
+def add_param(cmd: List[str], key: str, value):
+    """添加非空参数，路径参数会被引用"""
+    if value is not None and value != '':
+        if key in _PATH_PARAMS:
+            cmd.append(f"{key}={hydra_quote(value)}")
+        else:
+            cmd.append(f"{key}={value}")
+
+def add_list_param(cmd: List[str], key: str, items):
+    """添加列表参数"""
+    if items:
+        items_str = ",".join([f"{_SQ}{item}{_SQ}" for item in items])
+        cmd.append(f"{key}=[{items_str}]")
 
 def build_command(job_id: str, audio_path: str, params: dict) -> List[str]:
     """构建推理命令"""
-    python_executable = sys.executable
-    
     # 创建job专用输出目录
     job_output_dir = OUTPUTS / job_id
     job_output_dir.mkdir(exist_ok=True)
+    _missing_dirs.pop(job_id, None)
     
-    cmd = [python_executable, "inference.py", "-cn"]
-    
-    # 模型配置名称（对应configs/inference/下的yaml文件）
-    config_name = params.get("model", "v30")  # 默认使用v30配置
-    cmd.append(config_name)
-    
-    # Hydra参数引用函数
-    def hydra_quote(value):
-        return f"'{str(value).replace(chr(39), chr(92) + chr(39))}'"
-    
-    def add_param(key, value):
-        if value is not None and value != '':
-            if key in {"audio_path", "output_path", "beatmap_path"}:
-                cmd.append(f"{key}={hydra_quote(value)}")
-            else:
-                cmd.append(f"{key}={value}")
-    
-    def add_list_param(key, items):
-        if items:
-            quoted_items = [f"'{str(item)}'" for item in items]
-            items_str = ",".join(quoted_items)
-            cmd.append(f"{key}=[{items_str}]")
+    # 模型配置名称（对应configs/inference/下的yaml文件），默认使用v30配置
+    cmd = [sys.executable, "inference.py", "-cn", params.get("model", "v30")]
     
     # 必需参数
-    add_param("audio_path", audio_path)
-    add_param("output_path", str(job_output_dir))
-    
-    # 可选参数
-    add_param("gamemode", params.get("gamemode", 0))
-    add_param("difficulty", params.get("difficulty"))
-    add_param("year", params.get("year"))
-    add_param("mapper_id", params.get("mapper_id"))
-    
-    # 难度设置
-    for param in ['hp_drain_rate', 'circle_size', 'overall_difficulty', 
-                  'approach_rate', 'slider_multiplier', 'slider_tick_rate']:
-        add_param(param, params.get(param))
+    add_param(cmd, "audio_path", audio_path)
+    add_param(cmd, "output_path", str(job_output_dir))
     
-    # Mania专用
-    add_param("keycount", params.get("keycount"))
-    add_param("hold_note_ratio", params.get("hold_note_ratio"))
-    add_param("scroll_speed_ratio", params.get("scroll_speed_ratio"))
-    
-    # 生成设置
-    add_param("cfg_scale", params.get("cfg_scale", 1.0))
-    add_param("temperature", params.get("temperature", 1.0))
-    add_param("top_p", params.get("top_p", 0.95))
-    add_param("seed", params.get("seed"))
-    
-    # 时间设置
-    add_param("start_time", params.get("start_time"))
-    add_param("end_time", params.get("end_time"))
+    # 可选参数（一次遍历，跳过空值）
+    cmd.extend([
+        f"{key}={value}"
+        for key, value in ((key, params.get(key, default)) for key, default in _PARAM_SPECS)
+        if value is not None and value != ''
+    ])
     
     # 布尔选项
-    cmd.append(f"export_osz={str(params.get('export_osz', True)).lower()}")
-    cmd.append(f"add_to_beatmap={str(params.get('add_to_beatmap', False)).lower()}")
-    cmd.append(f"hitsounded={str(params.get('hitsounded', False)).lower()}")
-    cmd.append(f"super_timing={str(params.get('super_timing', False)).lower()}")
+    cmd.extend([f"{key}={str(params.get(key, default)).lower()}" for key, default in _BOOL_PARAM_SPECS])
     
     # 列表参数
-    add_list_param("descriptors", params.get("descriptors"))
-    add_list_param("negative_descriptors", params.get("negative_descriptors"))
+    for key in _LIST_PARAMS:
+        add_list_param(cmd, key, params.get(key))
     
     return cmd
 
+def invalidate_output_files(job_id: str):
+    """任务状态变化时清除本地文件列表缓存"""
+    _files_cache.pop(job_id, None)
+    _listing_cache.pop(job_id, None)
+
 def find_output_files(job_id: str) -> List[str]:
     """查找输出文件，优先使用缓存"""
-    # 先尝试从缓存获取
+    now = time.time()
+    local_cached = _files_cache.get(job_id)
+    if local_cached and now - local_cached[0] < FILES_CACHE_TTL:
+        return local_cached[1]
+    
+    # 再尝试从Redis缓存获取
     cached_files = get_cached_output_files(job_id)
     
     job_output_dir = OUTPUTS / job_id
-    if not job_output_dir.exists():
-        return cached_files or []
+    if not output_dir_exists(job_id):
+        result = cached_files or []
+        _files_cache[job_id] = (now, result)
+        return result
     
-    files = []
-    for file_path in job_output_dir.iterdir():
-        if file_path.is_file():
-            files.append(file_path.name)
+    # DirEntry.is_file()使用目录读取时得到的文件类型，无需逐个stat
+    with os.scandir(job_output_dir) as entries:
+        files = [entry.name for entry in entries if entry.is_file()]
     
     # 缓存文件列表
     if files:
         cache_output_files(job_id, files)
     
     # 如果目录为空但缓存有数据，返回缓存数据
-    return files if files else (cached_files or [])
+    result = files if files else (cached_files or [])
+    _files_cache[job_id] = (now, result)
+    return result
+
+async def iter_output_lines(stream: asyncio.StreamReader):
+    """逐行读取子进程输出，与universal_newlines一致地把\\r和\\r\\n视为换行（tqdm用\\r刷新进度条）"""
+    decoder = io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder('utf-8')(errors='replace'),
+        translate=True
+    )
+    pending = ""
+    while True:
+        chunk = await stream.read(OUTPUT_READ_SIZE)
+        pending += decoder.decode(chunk, final=not chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line + "\n"
+        if not chunk:
+            if pending:
+                yield pending
+            return
+
+async def monitor_process_output(job_id: str, process: asyncio.subprocess.Process):
+    """后台监控进程输出，是进程stdout的唯一读取者"""
+    output_lines = process_outputs.get(job_id)
+    try:
+        if process.stdout:
+            async for line in iter_output_lines(process.stdout):
+                # 更新进度
+                update_job_progress(job_id, line)
+                
+                # 存储输出（每个任务独占自己的列表，append无需全局锁）
+                if output_lines is not None:
+                    output_lines.append(line)
+                    output_line_counts[job_id] = output_line_counts.get(job_id, 0) + 1
+        
+        # 进程结束后标记进度为完成
+        return_code = await process.wait()
+        invalidate_output_files(job_id)
+        completed_at = time.time()
+        with get_job_lock(job_id):
+            if job_id in job_progress:
+                if return_code == 0:
+                    job_progress[job_id]['progress'] = 100.0
+                    job_progress[job_id]['stage'] = 'completed'
+                else:
+                    job_progress[job_id]['stage'] = 'failed'
+                job_progress[job_id]['completed_at'] = completed_at
+                # 缓存最终进度状态
+                cache_job_progress(job_id)
+        mark_job_finished(job_id, completed_at)
+    
+    except Exception as e:
+        print(f"监控进程输出错误 {job_id}: {e}")
+        with get_job_lock(job_id):
+            if job_id in job_progress:
+                job_progress[job_id]['stage'] = 'error'
+                job_progress[job_id]['completed_at'] = time.time()
+                cache_job_progress(job_id)
+        mark_job_finished(job_id, time.time())
+
+async def follow_job_output(job_id: str):
+    """跟随任务输出：逐行产出监控任务收集到的输出，直到任务结束"""
+    sent_lines = 0
+    while True:
+        progress_info = job_progress.get(job_id, {})
+        finished = 'completed_at' in progress_info or progress_info.get('stage') == 'error'
+        
+        # 缓冲区只保留最近的行，跟随过慢时跳过已被丢弃的部分
+        buffer = process_outputs.get(job_id, ())
+        new_count = min(output_line_counts.get(job_id, 0) - sent_lines, len(buffer))
+        new_lines = list(itertools.islice(buffer, len(buffer) - new_count, None)) if new_count > 0 else []
+        sent_lines = output_line_counts.get(job_id, 0)
+        for line in new_lines:
+            yield line
+        
+        if not new_lines:
+            if finished:
+                return
+            await asyncio.sleep(OUTPUT_POLL_INTERVAL)
 
 @app.get("/")
 async def root():
@@ -585,18 +915,20 @@ async def root():
         "description": "上传音频+参数，生成osu! beatmap",
         "endpoints": {
             "process": "POST /process - 上传音频和参数开始处理",
+            "validate": "POST /process/validate - 只校验推理参数，不上传音频也不创建任务",
+            "chunked_upload": "POST /process/init, PUT /process/chunk/{upload_id}/{index}, POST /process/finalize/{upload_id} - 分块上传大文件",
             "status": "GET /jobs/{job_id}/status - 查询任务状态",
             "progress": "GET /jobs/{job_id}/progress - 查询任务进度",
+            "progress_stream": "GET /jobs/{job_id}/progress/stream - 进度变化推送流",
             "stream": "GET /jobs/{job_id}/stream - 实时输出流",
+            "ws": "WS /jobs/{job_id}/ws - 实时输出流 (WebSocket, 支持压缩)",
             "download": "GET /jobs/{job_id}/download - 下载结果文件",
             "files": "GET /jobs/{job_id}/files - 列出所有输出文件",
             "cancel": "POST /jobs/{job_id}/cancel - 取消任务"
         }
     }
 
-@app.post("/process", response_model=ProcessResponse)
-async def process_audio(
-    audio_file: UploadFile = File(..., description="音频文件"),
+async def parse_inference_params(
     model: str = Form(default="v30", description="模型配置名称 (v30, v31, default等)"),
     gamemode: int = Form(default=0, description="游戏模式 (0=osu!, 1=taiko, 2=catch, 3=mania)"),
     difficulty: Optional[float] = Form(default=5.0, description="目标难度星级"),
@@ -623,160 +955,298 @@ async def process_audio(
     super_timing: bool = Form(default=False, description="使用超级时间生成"),
     descriptors: Optional[str] = Form(None, description="风格描述符(JSON数组)"),
     negative_descriptors: Optional[str] = Form(None, description="负面描述符(JSON数组)")
-):
-    """处理音频文件和参数"""
-    job_id = str(uuid.uuid4())
-    
-    with process_lock:
-        if job_id in active_processes:
-            raise HTTPException(status_code=409, detail="任务ID冲突")
-        
+) -> Dict[str, Any]:
+    """解析推理参数表单，/process 与 /process/init 共用"""
+    # 解析JSON参数
+    desc_list = None
+    if descriptors and descriptors.strip():
         try:
-            # 保存音频文件
-            audio_path = save_audio_file(audio_file, job_id)
-            
-            # 保存实际的音频内容
-            with open(audio_path, "wb") as buffer:
-                content = await audio_file.read()
-                buffer.write(content)
-            
-            # 解析JSON参数
+            desc_list = json_loads(descriptors)
+        except json.JSONDecodeError:
             desc_list = None
-            if descriptors and descriptors.strip():
-                try:
-                    desc_list = json.loads(descriptors)
-                except json.JSONDecodeError:
-                    desc_list = None
-            
+    
+    neg_desc_list = None
+    if negative_descriptors and negative_descriptors.strip():
+        try:
+            neg_desc_list = json_loads(negative_descriptors)
+        except json.JSONDecodeError:
             neg_desc_list = None
-            if negative_descriptors and negative_descriptors.strip():
-                try:
-                    neg_desc_list = json.loads(negative_descriptors)
-                except json.JSONDecodeError:
-                    neg_desc_list = None
-            
-            # 构建参数字典，处理字符串参数转换
-            params = {
-                "model": model,
-                "gamemode": gamemode,
-                "difficulty": difficulty,
-                "year": year,
-                "mapper_id": parse_optional_int(mapper_id) if mapper_id else None,
-                "hp_drain_rate": hp_drain_rate,
-                "circle_size": circle_size,
-                "overall_difficulty": overall_difficulty,
-                "approach_rate": approach_rate,
-                "slider_multiplier": slider_multiplier,
-                "slider_tick_rate": slider_tick_rate,
-                "keycount": parse_optional_int(keycount) if keycount else None,
-                "hold_note_ratio": parse_optional_float(hold_note_ratio) if hold_note_ratio else None,
-                "scroll_speed_ratio": parse_optional_float(scroll_speed_ratio) if scroll_speed_ratio else None,
-                "cfg_scale": cfg_scale,
-                "temperature": temperature,
-                "top_p": top_p,
-                "seed": parse_optional_int(seed) if seed else None,
-                "start_time": parse_optional_int(start_time) if start_time else None,
-                "end_time": parse_optional_int(end_time) if end_time else None,
-                "export_osz": export_osz,
-                "add_to_beatmap": add_to_beatmap,
-                "hitsounded": hitsounded,
-                "super_timing": super_timing,
-                "descriptors": desc_list,
-                "negative_descriptors": neg_desc_list
-            }
-            
-            # 构建命令
-            cmd = build_command(job_id, audio_path, params)
-            print(f"启动任务 {job_id}: {' '.join(cmd)}")
-            
-            # 启动进程
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                bufsize=1,
-                universal_newlines=True,
-                encoding='utf-8',
-                errors='replace'
-            )
-            
-            active_processes[job_id] = process
-            process_outputs[job_id] = []
-            job_metadata[job_id] = {
-                "audio_path": audio_path,
-                "audio_filename": audio_file.filename,
-                "params": params,
-                "start_time": time.time()
-            }
-            job_progress[job_id] = {
-                "progress": 0.0,
-                "stage": "started",
-                "last_update": time.time(),
-                "estimated": False
-            }
-            
-            # 缓存初始任务信息
-            cache_job_metadata(job_id)
+    
+    # 构建参数字典，处理字符串参数转换
+    return {
+        "model": model,
+        "gamemode": gamemode,
+        "difficulty": difficulty,
+        "year": year,
+        "mapper_id": parse_optional_int(mapper_id) if mapper_id else None,
+        "hp_drain_rate": hp_drain_rate,
+        "circle_size": circle_size,
+        "overall_difficulty": overall_difficulty,
+        "approach_rate": approach_rate,
+        "slider_multiplier": slider_multiplier,
+        "slider_tick_rate": slider_tick_rate,
+        "keycount": parse_optional_int(keycount) if keycount else None,
+        "hold_note_ratio": parse_optional_float(hold_note_ratio) if hold_note_ratio else None,
+        "scroll_speed_ratio": parse_optional_float(scroll_speed_ratio) if scroll_speed_ratio else None,
+        "cfg_scale": cfg_scale,
+        "temperature": temperature,
+        "top_p": top_p,
+        "seed": parse_optional_int(seed) if seed else None,
+        "start_time": parse_optional_int(start_time) if start_time else None,
+        "end_time": parse_optional_int(end_time) if end_time else None,
+        "export_osz": export_osz,
+        "add_to_beatmap": add_to_beatmap,
+        "hitsounded": hitsounded,
+        "super_timing": super_timing,
+        "descriptors": desc_list,
+        "negative_descriptors": neg_desc_list
+    }
+
+def queue_position(job_id: str) -> Optional[int]:
+    """返回任务的排队位置（从1开始），未在排队时返回None"""
+    try:
+        return _inference_queue.index(job_id) + 1
+    except ValueError:
+        return None
+
+async def wait_for_job_start(job_id: str) -> Optional[asyncio.subprocess.Process]:
+    """等待排队中的任务启动，返回其进程；任务不存在或未能启动时返回None"""
+    while job_id in _inference_queue:
+        await asyncio.sleep(OUTPUT_POLL_INTERVAL)
+    return active_processes.get(job_id)
+
+def fail_queued_job(job_id: str, stage: str, message: str):
+    """将未启动的任务标记为结束（启动失败或排队时被取消）"""
+    output_lines = process_outputs.get(job_id)
+    if output_lines is not None:
+        output_lines.append(message)
+        output_line_counts[job_id] = output_line_counts.get(job_id, 0) + 1
+    completed_at = time.time()
+    with get_job_lock(job_id):
+        if job_id in job_progress:
+            job_progress[job_id]['stage'] = stage
+            job_progress[job_id]['last_update'] = completed_at
+            job_progress[job_id]['completed_at'] = completed_at
             cache_job_progress(job_id)
-            
-            # 启动后台线程监控进程输出
-            def monitor_process_output(job_id, process):
-                """后台监控进程输出"""
-                try:
-                    if process.stdout:
-                        for line in iter(process.stdout.readline, ""):
-                            if not line:
-                                break
-                            
-                            # 更新进度
-                            update_job_progress(job_id, line)
-                            
-                            # 存储输出
-                            with process_lock:
-                                if job_id in process_outputs:
-                                    process_outputs[job_id].append(line)
-                    
-                    # 进程结束后标记进度为完成
-                    return_code = process.wait()
-                    with process_lock:
-                        if job_id in job_progress:
-                            if return_code == 0:
-                                job_progress[job_id]['progress'] = 100.0
-                                job_progress[job_id]['stage'] = 'completed'
-                            else:
-                                job_progress[job_id]['stage'] = 'failed'
-                            job_progress[job_id]['completed_at'] = time.time()
-                            # 缓存最终进度状态
-                            cache_job_progress(job_id)
-                
-                except Exception as e:
-                    print(f"监控进程输出错误 {job_id}: {e}")
-                    with process_lock:
-                        if job_id in job_progress:
-                            job_progress[job_id]['stage'] = 'error'
-                            cache_job_progress(job_id)
-            
-            # 启动监控线程
-            monitor_thread = threading.Thread(
-                target=monitor_process_output, 
-                args=(job_id, process),
-                daemon=True
-            )
-            monitor_thread.start()
-            
-            print(f"任务 {job_id} 已启动 (PID: {process.pid})")
-            
-            return ProcessResponse(
-                job_id=job_id,
-                status="started",
-                message=f"处理已开始，音频文件: {audio_file.filename}"
+    mark_job_finished(job_id, completed_at)
+
+async def run_inference_job(job_id: str, cmd: List[str]):
+    """排队获取推理名额后启动子进程，名额在进程结束前一直占用"""
+    async with _inference_semaphore:
+        # 排队期间已被取消
+        if job_id not in _inference_queue:
+            return
+        
+        try:
+            print(f"启动任务 {job_id}: {' '.join(cmd)}")
+            # 启动进程（asyncio子进程，输出直接在事件循环中异步读取，无需监控线程）
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT
             )
-            
-        except json.JSONDecodeError as e:
-            raise HTTPException(status_code=400, detail=f"JSON参数解析错误: {str(e)}")
         except Exception as e:
             print(f"启动任务失败: {e}")
-            raise HTTPException(status_code=500, detail=f"启动处理失败: {str(e)}")
+            if job_id not in _inference_queue:
+                return
+            _inference_queue.remove(job_id)
+            fail_queued_job(job_id, 'failed', f"启动处理失败: {str(e)}")
+            return
+        
+        # 先登记进程再移出队列，查询时任务始终处于排队或运行之一
+        with process_lock:
+            cancelled = job_id not in _inference_queue
+            if not cancelled:
+                active_processes[job_id] = process
+                metadata = job_metadata.get(job_id)
+                if metadata is not None:
+                    metadata.pid = process.pid
+                    metadata.start_time = time.time()
+                _inference_queue.remove(job_id)
+        if cancelled:
+            # 启动期间被取消
+            process.kill()
+            await process.wait()
+            return
+        
+        with get_job_lock(job_id):
+            if job_id in job_progress:
+                job_progress[job_id].update({
+                    "stage": "started",
+                    "last_update": time.time()
+                })
+        
+        cache_job_metadata(job_id)
+        cache_job_progress(job_id)
+        print(f"任务 {job_id} 已启动 (PID: {process.pid})")
+        
+        await monitor_process_output(job_id, process)
+
+async def start_inference_job(job_id: str, audio_path: str, audio_filename: Optional[str],
+                              params: Dict[str, Any]) -> ProcessResponse:
+    """登记任务并加入推理队列，名额空闲时立即启动子进程"""
+    with process_lock:
+        if job_id in active_processes or job_id in job_metadata:
+            raise HTTPException(status_code=409, detail="任务ID冲突")
+    
+    try:
+        # 构建命令
+        cmd = build_command(job_id, audio_path, params)
+    except Exception as e:
+        print(f"启动任务失败: {e}")
+        raise HTTPException(status_code=500, detail=f"启动处理失败: {str(e)}")
+    
+    queued = _inference_semaphore.locked()
+    with process_lock:
+        process_outputs[job_id] = deque(maxlen=MAX_OUTPUT_LINES)
+        output_line_counts[job_id] = 0
+        job_locks[job_id] = threading.Lock()
+        job_metadata[job_id] = JobMeta(
+            audio_path=audio_path,
+            audio_filename=audio_filename,
+            start_time=time.time(),
+            params=params,
+            pid=None
+        )
+        job_progress[job_id] = {
+            "progress": 0.0,
+            "stage": "queued",
+            "last_update": time.time(),
+            "estimated": False
+        }
+        _inference_queue.append(job_id)
+    
+    # 缓存初始任务信息
+    cache_job_metadata(job_id)
+    cache_job_progress(job_id)
+    
+    # 后台任务排队启动进程并监控输出
+    inference_task = asyncio.create_task(run_inference_job(job_id, cmd))
+    _background_tasks.add(inference_task)
+    inference_task.add_done_callback(_background_tasks.discard)
+    
+    if queued:
+        return ProcessResponse(
+            job_id=job_id,
+            status="queued",
+            message=f"任务已排队 (位置: {queue_position(job_id)})，音频文件: {audio_filename}"
+        )
+    return ProcessResponse(
+        job_id=job_id,
+        status="started",
+        message=f"处理已开始，音频文件: {audio_filename}"
+    )
+
+@app.post("/process", response_model=ProcessResponse)
+async def process_audio(
+    audio_file: UploadFile = File(..., description="音频文件"),
+    params: Dict[str, Any] = Depends(parse_inference_params)
+):
+    """处理音频文件和参数"""
+    job_id = str(uuid.uuid4())
+    
+    # 保存音频文件 - 在获取锁之前分块写入磁盘，不把整个文件读入内存
+    try:
+        audio_path, buffer = open_audio_file(audio_file, job_id)
+        with buffer:
+            while chunk := await audio_file.read(UPLOAD_CHUNK_SIZE):
+                buffer.write(chunk)
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"保存音频文件失败: {str(e)}")
+    
+    return await start_inference_job(job_id, audio_path, audio_file.filename, params)
+
+@app.post("/process/validate")
+async def validate_process_params(params: Dict[str, Any] = Depends(parse_inference_params)):
+    """只解析推理参数并返回解析结果，不上传音频也不启动任务（用于参数校验测试）"""
+    return {"valid": True, "params": params}
+
+@app.post("/process/init")
+async def init_chunked_upload(
+    filename: str = Form(..., description="音频文件名"),
+    params: Dict[str, Any] = Depends(parse_inference_params)
+):
+    """初始化分块上传 - 大文件可拆分为多个分块并行上传，最后调用finalize开始处理"""
+    file_ext = audio_file_extension(filename)
+    
+    upload_id = str(uuid.uuid4())
+    (AUDIO_STORAGE / upload_id).mkdir()
+    _uploads[upload_id] = {
+        "filename": filename,
+        "file_ext": file_ext,
+        "params": params,
+        "created_at": time.time()
+    }
+    
+    return {
+        "upload_id": upload_id,
+        "chunk_size": UPLOAD_PART_SIZE
+    }
+
+@app.put("/process/chunk/{upload_id}/{index}")
+async def upload_chunk(upload_id: str, index: int, request: Request):
+    """上传单个分块（请求体为原始字节）- 每个分块写入独立文件，可以并行上传"""
+    if upload_id not in _uploads:
+        raise HTTPException(status_code=404, detail="上传会话不存在")
+    if index < 0 or index >= MAX_UPLOAD_PARTS:
+        raise HTTPException(status_code=400, detail=f"分块序号超出范围 (0-{MAX_UPLOAD_PARTS - 1})")
+    
+    # 先写入临时文件，完整接收后再改名，避免中断的分块被当作完整分块
+    part_path = AUDIO_STORAGE / upload_id / f"{index}.part"
+    temp_path = part_path.with_name(f"{index}.part.tmp")
+    size = 0
+    try:
+        with open(temp_path, "wb") as buffer:
+            async for chunk in request.stream():
+                size += len(chunk)
+                # 单个分块最大为 UPLOAD_PART_SIZE，超出时立即停止接收
+                if size > UPLOAD_PART_SIZE:
+                    break
+                buffer.write(chunk)
+        if size > UPLOAD_PART_SIZE:
+            temp_path.unlink(missing_ok=True)
+            raise HTTPException(status_code=413, detail=f"分块过大，单个分块最大 {UPLOAD_PART_SIZE} 字节")
+        os.replace(temp_path, part_path)
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"保存分块失败: {str(e)}")
+    
+    return {
+        "upload_id": upload_id,
+        "index": index,
+        "size": size
+    }
+
+@app.post("/process/finalize/{upload_id}", response_model=ProcessResponse)
+async def finalize_chunked_upload(
+    upload_id: str,
+    total_chunks: int = Form(..., description="分块总数")
+):
+    """合并所有分块并开始处理"""
+    if upload_id not in _uploads:
+        raise HTTPException(status_code=404, detail="上传会话不存在")
+    # 先校验分块数，再逐个检查分块文件
+    if not 0 < total_chunks <= MAX_UPLOAD_PARTS:
+        raise HTTPException(status_code=400, detail=f"分块总数超出范围 (1-{MAX_UPLOAD_PARTS})")
+    upload = _uploads.pop(upload_id)
+    
+    upload_dir = AUDIO_STORAGE / upload_id
+    part_paths = [upload_dir / f"{index}.part" for index in range(total_chunks)]
+    missing = [index for index, part_path in enumerate(part_paths) if not part_path.exists()]
+    if missing:
+        # 保留会话，允许补传缺失的分块后重试
+        _uploads[upload_id] = upload
+        raise HTTPException(status_code=400, detail=f"分块不完整，缺少: {missing[:20]}")
+    
+    job_id = str(uuid.uuid4())
+    audio_path = job_audio_path(job_id, upload["file_ext"])
+    try:
+        await asyncio.to_thread(assemble_upload_parts, part_paths, audio_path)
+    except OSError as e:
+        _uploads[upload_id] = upload
+        raise HTTPException(status_code=500, detail=f"合并分块失败: {str(e)}")
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    
+    return await start_inference_job(job_id, audio_path, upload["filename"], upload["params"])
 
 @app.get("/jobs/{job_id}/status", response_model=JobStatus)
 async def get_status(job_id: str):
@@ -793,23 +1263,34 @@ async def get_status(job_id: str):
             
             # 从缓存恢复数据
             if cached_progress:
-                job_progress[job_id] = cached_progress
+                restore_job_progress(job_id, cached_progress)
             if cached_metadata:
-                job_metadata[job_id] = cached_metadata
+                job_metadata[job_id] = JobMeta.from_dict(cached_metadata)
         
-        metadata = job_metadata.get(job_id, {})
         progress_info = job_progress.get(job_id, {})
         current_progress = progress_info.get('progress', 0.0)
         stage = progress_info.get('stage', 'unknown')
         
+        # 任务仍在排队等待推理名额
+        position = queue_position(job_id)
+        if position is not None:
+            return job_status_response(
+                job_id=job_id,
+                status="queued",
+                message=f"排队中 (位置: {position})",
+                progress=current_progress,
+                output_files=None,
+                error=None
+            )
+        
         # 如果任务还在活动进程中
         if job_id in active_processes:
             process = active_processes[job_id]
-            return_code = process.poll()
+            return_code = process.returncode
             
             if return_code is None:
                 # 进程运行中
-                return JobStatus(
+                return job_status_response(
                     job_id=job_id,
                     status="running",
                     message=f"正在处理中... ({stage})",
@@ -820,13 +1301,13 @@ async def get_status(job_id: str):
             elif return_code == 0:
                 # 进程成功完成
                 output_files = find_output_files(job_id)
-                # 确保进度为100%
-                with process_lock:
+                # 确保进度为100%（此处已持有process_lock，不能再次获取）
+                with get_job_lock(job_id):
                     if job_id in job_progress:
                         job_progress[job_id]['progress'] = 100.0
                         cache_job_progress(job_id)
                 
-                return JobStatus(
+                return job_status_response(
                     job_id=job_id,
                     status="completed",
                     message="处理完成",
@@ -836,7 +1317,7 @@ async def get_status(job_id: str):
                 )
             else:
                 # 进程失败
-                return JobStatus(
+                return job_status_response(
                     job_id=job_id,
                     status="failed",
                     message="处理失败",
@@ -849,7 +1330,7 @@ async def get_status(job_id: str):
             output_files = find_output_files(job_id)
             if output_files:
                 # 有输出文件，说明成功完成
-                return JobStatus(
+                return job_status_response(
                     job_id=job_id,
                     status="completed",
                     message="处理完成",
@@ -862,7 +1343,7 @@ async def get_status(job_id: str):
                 final_progress = 100.0 if current_progress >= 100.0 else current_progress
                 status = "completed" if final_progress >= 100.0 else "failed"
                 
-                return JobStatus(
+                return job_status_response(
                     job_id=job_id,
                     status=status,
                     message="处理完成" if status == "completed" else "处理可能失败",
@@ -871,107 +1352,151 @@ async def get_status(job_id: str):
                     error=None if status == "completed" else "未找到输出文件"
                 )
 
+def load_job_progress(job_id: str) -> bool:
+    """确认任务进度信息存在，必要时从缓存恢复（调用方需持有process_lock）"""
+    if job_id in active_processes or job_id in job_progress:
+        return True
+    
+    # 尝试从缓存加载
+    cached_progress = get_cached_job_progress(job_id)
+    if not cached_progress:
+        return False
+    
+    # 从缓存恢复进度数据
+    restore_job_progress(job_id, cached_progress)
+    return True
+
+def process_status(process: asyncio.subprocess.Process) -> str:
+    """根据进程返回码确定状态，返回码由事件循环在子进程退出时设置，无需poll系统调用"""
+    return_code = process.returncode
+    if return_code is None:
+        return "running"
+    return "completed" if return_code == 0 else "failed"
+
+def job_run_status(job_id: str, progress_info: Dict) -> str:
+    """根据进程返回码（或已保存的进度）确定任务状态"""
+    process = active_processes.get(job_id)
+    if process is not None:
+        return process_status(process)
+    if job_id in _inference_queue:
+        return "queued"
+    
+    # 任务已完成或失败
+    return "completed" if progress_info.get('progress', 0) == 100.0 else "unknown"
+
 @app.get("/jobs/{job_id}/progress", response_model=ProgressResponse)
 async def get_progress(job_id: str):
     """获取任务详细进度信息，优先使用缓存"""
     with process_lock:
         # 检查任务是否存在
-        if job_id not in active_processes and job_id not in job_progress:
-            # 尝试从缓存加载
-            cached_progress = get_cached_job_progress(job_id)
-            if not cached_progress:
-                raise HTTPException(status_code=404, detail="任务不存在")
-            
-            # 从缓存恢复进度数据
-            job_progress[job_id] = cached_progress
+        if not load_job_progress(job_id):
+            raise HTTPException(status_code=404, detail="任务不存在")
         
         progress_info = job_progress.get(job_id, {})
+        status = job_run_status(job_id, progress_info)
         
-        # 确定任务状态
-        if job_id in active_processes:
-            process = active_processes[job_id]
-            return_code = process.poll()
-            
-            if return_code is None:
-                status = "running"
-            elif return_code == 0:
-                status = "completed"
-            else:
-                status = "failed"
-        else:
-            # 任务已完成或失败
-            status = "completed" if progress_info.get('progress', 0) == 100.0 else "unknown"
-        
-        return ProgressResponse(
+        return progress_response(
             job_id=job_id,
             progress=progress_info.get('progress', 0.0),
             stage=progress_info.get('stage', 'unknown'),
             estimated=progress_info.get('estimated', True),
             last_update=progress_info.get('last_update', time.time()),
-            status=status
+            status=status,
+            queue_position=queue_position(job_id)
         )
 
-@app.get("/jobs/{job_id}/stream")
-async def stream_output(job_id: str):
-    """实时输出流"""
+@app.get("/jobs/{job_id}/progress/stream")
+async def stream_progress(job_id: str):
+    """进度推送流 - 只在进度、阶段或状态变化时推送，替代对/progress的轮询"""
     
     async def event_generator():
+        # 不能在持有线程锁时yield，否则生成器挂起期间其他请求会阻塞事件循环
         with process_lock:
-            if job_id not in active_processes:
+            exists = load_job_progress(job_id)
+        if not exists:
+            yield {
+                "event": "error",
+                "data": "任务不存在"
+            }
+            return
+        
+        last_key = None
+        while True:
+            progress_info = job_progress.get(job_id, {})
+            status = job_run_status(job_id, progress_info)
+            snapshot = {
+                "job_id": job_id,
+                "progress": progress_info.get('progress', 0.0),
+                "stage": progress_info.get('stage', 'unknown'),
+                "estimated": progress_info.get('estimated', True),
+                "last_update": progress_info.get('last_update', time.time()),
+                "status": status,
+                "queue_position": queue_position(job_id)
+            }
+            
+            key = (snapshot["progress"], snapshot["stage"], status, snapshot["queue_position"])
+            if key != last_key:
+                last_key = key
                 yield {
-                    "event": "error",
-                    "data": "任务不存在"
+                    "event": "progress",
+                    "data": json_dumps(snapshot)
                 }
-                return
             
-            process = active_processes[job_id]
+            if status not in ("running", "queued"):
+                return
+            await asyncio.sleep(OUTPUT_POLL_INTERVAL)
+    
+    return EventSourceResponse(event_generator())
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_output(job_id: str):
+    """实时输出流"""
+    
+    async def event_generator():
+        # 排队中的任务先等待其启动
+        process = await wait_for_job_start(job_id)
+        if process is None:
+            yield {
+                "event": "error",
+                "data": "任务不存在"
+            }
+            return
         
         print(f"开始流式输出任务 {job_id}")
         
         try:
-            if process.stdout:
-                for line in iter(process.stdout.readline, ""):
-                    if not line:
-                        break
-                    
-                    # 更新进度
-                    update_job_progress(job_id, line)
-                    
-                    # 存储输出
-                    with process_lock:
-                        if job_id in process_outputs:
-                            process_outputs[job_id].append(line)
-                    
-                    # 获取当前进度信息
-                    progress_info = job_progress.get(job_id, {})
-                    progress_value = progress_info.get('progress', 0.0)
-                    
-                    yield {
-                        "event": "output",
-                        "data": line.rstrip(),
-                        "progress": progress_value
-                    }
+            # stdout由监控任务统一读取并更新进度，这里只跟随已收集的输出
+            # 进度通过 /progress/stream 推送；sse_starlette的事件只接受标准SSE字段
+            async for line in follow_job_output(job_id):
+                yield {
+                    "event": "output",
+                    "data": line.rstrip()
+                }
             
             # 等待进程完成
-            return_code = process.wait()
+            return_code = await process.wait()
             
             # 标记进度为完成
-            with process_lock:
+            with get_job_lock(job_id):
                 if job_id in job_progress:
                     job_progress[job_id]['progress'] = 100.0
             
             if return_code == 0:
                 yield {
                     "event": "completed",
-                    "data": "处理完成",
-                    "progress": 100.0
+                    "data": "处理完成"
                 }
             else:
                 yield {
                     "event": "failed",
-                    "data": f"处理失败，退出代码: {return_code}",
-                    "progress": job_progress.get(job_id, {}).get('progress', 0.0)
+                    "data": f"处理失败，退出代码: {return_code}"
                 }
+            
+            # 结束标记：生成器随后自然结束，由EventSourceResponse正常收尾，连接可被干净复用
+            yield {
+                "event": "close",
+                "data": "[DONE]"
+            }
                 
         except Exception as e:
             print(f"流式输出错误 {job_id}: {e}")
@@ -980,23 +1505,53 @@ async def stream_output(job_id: str):
                 "data": f"流式输出错误: {str(e)}"
             }
         finally:
-            # 清理
-            with process_lock:
-                if job_id in active_processes:
-                    del active_processes[job_id]
-                if job_id in job_progress:
-                    # 保留进度信息一段时间，方便查询
-                    job_progress[job_id]['completed_at'] = time.time()
-                print(f"清理任务 {job_id}")
+            # 进程和进度的清理由监控任务负责；客户端中途断开时任务仍在运行，这里只让文件列表缓存失效
+            invalidate_output_files(job_id)
     
     return EventSourceResponse(event_generator())
 
+@app.websocket("/jobs/{job_id}/ws")
+async def websocket_output(websocket: WebSocket, job_id: str):
+    """WebSocket实时输出流 - uvicorn默认协商permessage-deflate，重复的日志文本可被高效压缩"""
+    await websocket.accept()
+    
+    # 排队中的任务先等待其启动
+    process = await wait_for_job_start(job_id)
+    if process is None:
+        await websocket.send_json({"event": "error", "data": "任务不存在"})
+        await websocket.close()
+        return
+    
+    # 进度字典在任务生命周期内原地更新，只需查找一次
+    progress_info = job_progress.get(job_id, {})
+    try:
+        async for line in follow_job_output(job_id):
+            await websocket.send_json({
+                "event": "output",
+                "data": line.rstrip(),
+                "progress": progress_info.get('progress', 0.0)
+            })
+        
+        return_code = await process.wait()
+        if return_code == 0:
+            await websocket.send_json({"event": "completed", "data": "处理完成", "progress": 100.0})
+        else:
+            await websocket.send_json({
+                "event": "failed",
+                "data": f"处理失败，退出代码: {return_code}",
+                "progress": job_progress.get(job_id, {}).get('progress', 0.0)
+            })
+        await websocket.close()
+    
+    except WebSocketDisconnect:
+        print(f"WebSocket客户端断开 {job_id}")
+
 @app.get("/jobs/{job_id}/download")
 async def download_result(job_id: str, filename: Optional[str] = None):
     """下载结果文件"""
     job_output_dir = OUTPUTS / job_id
     
-    if not job_output_dir.exists():
+    if not output_dir_exists(job_id):
         raise HTTPException(status_code=404, detail="任务输出目录不存在")
     
     # 查找文件
@@ -1022,7 +1577,7 @@ async def download_result(job_id: str, filename: Optional[str] = None):
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="文件不存在")
     
-    return FileResponse(
+    return ChunkedFileResponse(
         path=str(file_path),
         filename=target_file,
         media_type='application/octet-stream'
@@ -1033,104 +1588,153 @@ async def list_files(job_id: str):
     """列出所有输出文件"""
     job_output_dir = OUTPUTS / job_id
     
-    if not job_output_dir.exists():
+    if not output_dir_exists(job_id):
         return {"files": []}
     
+    now = time.time()
+    local_cached = _listing_cache.get(job_id)
+    if local_cached and now - local_cached[0] < FILES_CACHE_TTL:
+        return {"files": local_cached[1]}
+    
+    # os.scandir的DirEntry缓存了文件类型和stat信息，避免逐个文件stat
     files = []
-    for file_path in job_output_dir.iterdir():
-        if file_path.is_file():
-            files.append({
-                "name": file_path.name,
-                "size": file_path.stat().st_size,
-                "type": file_path.suffix,
-                "download_url": f"/jobs/{job_id}/download?filename={file_path.name}"
-            })
+    with os.scandir(job_output_dir) as entries:
+        for entry in entries:
+            if entry.is_file():
+                files.append({
+                    "name": entry.name,
+                    "size": entry.stat().st_size,
+                    "type": os.path.splitext(entry.name)[1],
+                    "download_url": f"/jobs/{job_id}/download?filename={quote(entry.name)}"
+                })
     
+    _listing_cache[job_id] = (now, files)
     return {"files": files}
 
 @app.post("/jobs/{job_id}/cancel")
 async def cancel_job(job_id: str):
     """取消任务"""
     with process_lock:
-        if job_id not in active_processes:
+        if job_id in _inference_queue:
+            # 尚未启动的任务直接移出队列
+            _inference_queue.remove(job_id)
+            process = None
+        elif job_id not in active_processes:
             raise HTTPException(status_code=404, detail="任务不存在")
+        else:
+            process = active_processes[job_id]
+    
+    if process is None:
+        fail_queued_job(job_id, 'cancelled', "任务在排队时被取消")
+        return {"status": "cancelled", "message": "任务已取消"}
+    
+    if process.returncode is not None:
+        return {"status": "already_finished", "message": "任务已完成"}
+    
+    try:
+        process.terminate()
         
-        process = active_processes[job_id]
+        # 异步等待优雅终止，不阻塞事件循环，也不持有全局锁
+        try:
+            await asyncio.wait_for(process.wait(), timeout=5)
+            message = "任务已取消"
+        except asyncio.TimeoutError:
+            process.kill()
+            message = "任务已强制终止"
         
-        if process.poll() is not None:
-            return {"status": "already_finished", "message": "任务已完成"}
+        with process_lock:
+            active_processes.pop(job_id, None)
         
-        try:
-            process.terminate()
-            
-            # 等待优雅终止
-            try:
-                process.wait(timeout=5)
-                message = "任务已取消"
-            except subprocess.TimeoutExpired:
-                process.kill()
-                message = "任务已强制终止"
-            
-            del active_processes[job_id]
-            
-            return {
-                "status": "cancelled",
-                "message": message
-            }
-            
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"取消任务失败: {str(e)}")
+        return {
+            "status": "cancelled",
+            "message": message
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"取消任务失败: {str(e)}")
 
 @app.get("/jobs")
 async def list_jobs():
     """列出所有任务"""
+    # 持锁期间只拷贝一次任务快照
     with process_lock:
-        jobs = []
-        for job_id, process in active_processes.items():
-            return_code = process.poll()
-            status = "completed" if return_code == 0 else "failed" if return_code is not None else "running"
-            
-            metadata = job_metadata.get(job_id, {})
-            
-            jobs.append({
-                "job_id": job_id,
-                "status": status,
-                "audio_filename": metadata.get("audio_filename"),
-                "start_time": metadata.get("start_time"),
-                "pid": process.pid
-            })
+        snapshot = list(active_processes.items())
+        queued = list(_inference_queue)
+    
+    jobs = []
+    for job_id, process in snapshot:
+        metadata = job_metadata.get(job_id)
         
-        return {"jobs": jobs}
+        jobs.append({
+            "job_id": job_id,
+            "status": process_status(process),
+            "audio_filename": metadata.audio_filename if metadata else None,
+            "start_time": metadata.start_time if metadata else None,
+            "pid": process.pid
+        })
+    
+    for position, job_id in enumerate(queued, 1):
+        metadata = job_metadata.get(job_id)
+        jobs.append({
+            "job_id": job_id,
+            "status": "queued",
+            "audio_filename": metadata.audio_filename if metadata else None,
+            "start_time": metadata.start_time if metadata else None,
+            "pid": None,
+            "queue_position": position
+        })
+    
+    return {"jobs": jobs}
 
 def cleanup_finished_jobs():
-    """清理已完成的任务"""
+    """清理已完成的任务 - 只处理监控任务登记的结束队列，不扫描运行中的任务"""
     with process_lock:
         current_time = time.time()
         
         # 清理已完成的进程
-        finished_jobs = []
-        for job_id, process in active_processes.items():
-            if process.poll() is not None:
-                finished_jobs.append(job_id)
+        while _finished_queue:
+            job_id = _finished_queue.popleft()
+            if active_processes.pop(job_id, None) is not None:
+                print(f"清理已完成任务 {job_id}")
         
-        for job_id in finished_jobs:
-            print(f"清理已完成任务 {job_id}")
-            del active_processes[job_id]
-        
-        # 清理超过1小时的进度信息
-        old_progress_jobs = []
-        for job_id, progress_info in job_progress.items():
-            completed_at = progress_info.get('completed_at')
-            if completed_at and (current_time - completed_at) > 3600:  # 1小时
-                old_progress_jobs.append(job_id)
-        
-        for job_id in old_progress_jobs:
+        # 清理超过1小时的进度信息（队列按完成时间排列，遇到未过期的即停止）
+        while _completion_queue and current_time - _completion_queue[0][1] > 3600:  # 1小时
+            job_id, _ = _completion_queue.popleft()
+            if job_id not in job_progress:
+                continue
+            
             print(f"清理旧进度信息 {job_id}")
             del job_progress[job_id]
+            job_metadata.pop(job_id, None)
+            job_locks.pop(job_id, None)
+            process_outputs.pop(job_id, None)
+            output_line_counts.pop(job_id, None)
+            _response_cache.pop(f"status:{job_id}", None)
+            _response_cache.pop(f"progress:{job_id}", None)
             # 清理Redis缓存
             cache_delete(f"job_progress:{job_id}")
             cache_delete(f"job_metadata:{job_id}")
             cache_delete(f"output_files:{job_id}")
+        
+        # 清理过期的目录负缓存和文件列表缓存
+        expired_dirs = [job_id for job_id, checked_at in _missing_dirs.items()
+                        if current_time - checked_at > MISSING_DIR_TTL]
+        for job_id in expired_dirs:
+            del _missing_dirs[job_id]
+        
+        # 清理超时未完成的分块上传
+        expired_uploads = [upload_id for upload_id, upload in _uploads.items()
+                           if current_time - upload["created_at"] > UPLOAD_SESSION_TTL]
+        for upload_id in expired_uploads:
+            print(f"清理未完成的分块上传 {upload_id}")
+            del _uploads[upload_id]
+            shutil.rmtree(AUDIO_STORAGE / upload_id, ignore_errors=True)
+        
+        for cache in (_files_cache, _listing_cache):
+            expired_files = [job_id for job_id, (cached_at, _) in cache.items()
+                             if current_time - cached_at > FILES_CACHE_TTL]
+            for job_id in expired_files:
+                del cache[job_id]
 
 def cleanup_redis_cache():
     """清理过期的Redis缓存"""
@@ -1172,18 +1776,25 @@ async def startup_event():
     else:
         print("⚠️ Redis缓存未启用，使用内存缓存")
     
-    # 启动后台清理任务
-    async def periodic_cleanup():
+    # 扩大默认线程池，避免多个并发流式输出耗尽线程
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE)
+    )
+    
+    # 启动后台清理任务（各自独立计时，避免重复触发）
+    async def cleanup_jobs():
         while True:
             await asyncio.sleep(300)  # 每5分钟清理一次
             cleanup_finished_jobs()
-            
-            # 每小时清理一次Redis缓存
-            import time
-            if int(time.time()) % 3600 < 300:  # 在整点后5分钟内执行
-                cleanup_redis_cache()
-    
-    asyncio.create_task(periodic_cleanup())
+
+    async def cleanup_redis():
+        while True:
+            await asyncio.sleep(3600)  # 每小时清理一次Redis缓存
+            # 逐键的同步Redis调用放到线程中执行，不阻塞事件循环上的流式输出
+            await asyncio.to_thread(cleanup_redis_cache)
+
+    asyncio.create_task(cleanup_jobs())
+    asyncio.create_task(cleanup_redis())
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -1193,7 +1804,7 @@ async def shutdown_event():
     # 终止所有活动进程
     with process_lock:
         for job_id, process in active_processes.items():
-            if process.poll() is None:
+            if process.returncode is None:
                 print(f"终止任务 {job_id}")
                 process.terminate()
 
@@ -1258,9 +1869,11 @@ async def debug_job_output(job_id: str):
                 raise HTTPException(status_code=404, detail="任务不存在")
         
         # 获取最近的输出行
-        recent_outputs = process_outputs.get(job_id, [])[-20:]  # 最近20行
+        output_lines = process_outputs.get(job_id, ())
+        recent_outputs = list(itertools.islice(output_lines, max(0, len(output_lines) - 20), None))  # 最近20行
         progress_info = job_progress.get(job_id, {})
-        metadata = job_metadata.get(job_id, {})
+        metadata = job_metadata.get(job_id)
+        start_time = metadata.start_time if metadata else None
         
         # 获取缓存状态
         cache_status = {}
@@ -1275,9 +1888,9 @@ async def debug_job_output(job_id: str):
             "job_id": job_id,
             "recent_outputs": recent_outputs,
             "progress_info": progress_info,
-            "total_output_lines": len(process_outputs.get(job_id, [])),
-            "start_time": metadata.get("start_time"),
-            "elapsed_time": time.time() - metadata.get("start_time", time.time()),
+            "total_output_lines": output_line_counts.get(job_id, 0),
+            "start_time": start_time,
+            "elapsed_time": time.time() - start_time if start_time else 0.0,
             "is_active": job_id in active_processes,
             "cache_status": cache_status
         }
@@ -1289,13 +1902,23 @@ if __name__ == "__main__":
     parser.add_argument("--host", default="127.0.0.1", help="绑定主机")
     parser.add_argument("--port", type=int, default=8000, help="绑定端口")
     parser.add_argument("--reload", action="store_true", help="启用自动重载")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="工作进程数 (任务状态保存在进程内存中, 多进程时同一任务的请求可能落到其他进程)")
+    parser.add_argument("--unsafe-multi-worker", action="store_true",
+                        help="允许 --workers 大于1 (任务状态不在进程间共享, 仅适用于前端有会话粘滞的部署)")
+    parser.add_argument("--access-log", action="store_true", help="启用逐请求访问日志")
     
     args = parser.parse_args()
     
+    if args.workers > 1 and not args.unsafe_multi_worker:
+        parser.error("任务状态保存在进程内存中, --workers 大于1时需要同时指定 --unsafe-multi-worker")
+    
     print("🎮 Mapperatorinator API v2.0")
     print("=" * 50)
     print(f"🌐 API文档: http://{args.host}:{args.port}/docs")
     print(f"📚 ReDoc: http://{args.host}:{args.port}/redoc")
+    if args.workers > 1:
+        print(f"⚠️ 已启用 {args.workers} 个工作进程: 任务状态不在进程间共享, 同一任务的请求可能落到其他进程")
     print("=" * 50)
     
     uvicorn.run(
@@ -1303,5 +1926,9 @@ if __name__ == "__main__":
         host=args.host,
         port=args.port,
         reload=args.reload,
-        access_log=True
+        workers=args.workers,
+        # 安装了 uvloop / httptools (uvicorn[standard]) 时自动使用, Windows 下回退到 asyncio
+        loop="auto",
+        http="auto",
+        access_log=args.access_log
     )
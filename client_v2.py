@@ -4,13 +4,178 @@ Mapperatorinator API v2.0 客户端
 支持完整的音频+参数上传，实时监控，文件下载
 """
 
+import asyncio
+import codecs
+import importlib.util
+import io
 import json
 import requests
-import sseclient
 import sys
 import time
+from email.message import Message
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Optional, Any
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 可选的异步客户端依赖，安装h2后使用HTTP/2多路复用
+try:
+    import httpx
+except ImportError:
+    httpx = None
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# 可选的流式multipart编码，上传大音频文件时不把整个文件读入内存
+try:
+    from requests_toolbelt import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
+
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+
+# 输出流的结束事件，以及默认打印输出时刷新终端的最小间隔（秒）
+TERMINAL_EVENTS = frozenset({'completed', 'failed', 'error'})
+STREAM_FLUSH_INTERVAL = 0.05
+
+# 会话连接池大小，多线程并发请求时不必排队等待连接
+POOL_SIZE = 32
+
+# 等待任务完成时的轮询间隔从初始值按倍数增长到上限：短任务能被很快发现，长任务不会频繁请求
+POLL_BACKOFF = 1.5
+MAX_POLL_INTERVAL = 10.0
+
+
+def build_form_data(
+    model: str = "default",
+    gamemode: int = 0,
+    difficulty: Optional[float] = None,
+    year: Optional[int] = None,
+    mapper_id: Optional[int] = None,
+    hp_drain_rate: Optional[float] = None,
+    circle_size: Optional[float] = None,
+    overall_difficulty: Optional[float] = None,
+    approach_rate: Optional[float] = None,
+    slider_multiplier: Optional[float] = None,
+    slider_tick_rate: Optional[float] = None,
+    keycount: Optional[int] = None,
+    hold_note_ratio: Optional[float] = None,
+    scroll_speed_ratio: Optional[float] = None,
+    cfg_scale: float = 1.0,
+    temperature: float = 1.0,
+    top_p: float = 0.95,
+    seed: Optional[int] = None,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+    export_osz: bool = True,
+    add_to_beatmap: bool = False,
+    hitsounded: bool = False,
+    super_timing: bool = False,
+    descriptors: Optional[List[str]] = None,
+    negative_descriptors: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """构建 /process 的表单数据，省略未设置的可选参数"""
+    data = {
+        'model': model,
+        'gamemode': gamemode,
+        'cfg_scale': cfg_scale,
+        'temperature': temperature,
+        'top_p': top_p,
+        'export_osz': export_osz,
+        'add_to_beatmap': add_to_beatmap,
+        'hitsounded': hitsounded,
+        'super_timing': super_timing
+    }
+    
+    # 添加可选参数
+    optional_params = {
+        'difficulty': difficulty,
+        'year': year,
+        'mapper_id': mapper_id,
+        'hp_drain_rate': hp_drain_rate,
+        'circle_size': circle_size,
+        'overall_difficulty': overall_difficulty,
+        'approach_rate': approach_rate,
+        'slider_multiplier': slider_multiplier,
+        'slider_tick_rate': slider_tick_rate,
+        'keycount': keycount,
+        'hold_note_ratio': hold_note_ratio,
+        'scroll_speed_ratio': scroll_speed_ratio,
+        'seed': seed,
+        'start_time': start_time,
+        'end_time': end_time
+    }
+    
+    for key, value in optional_params.items():
+        if value is not None:
+            data[key] = value
+    
+    # 添加列表参数
+    if descriptors:
+        data['descriptors'] = json.dumps(descriptors)
+    if negative_descriptors:
+        data['negative_descriptors'] = json.dumps(negative_descriptors)
+    
+    return data
+
+
+@lru_cache(maxsize=64)
+def _cached_form_data(items: tuple) -> Dict[str, Any]:
+    return build_form_data(**{key: list(value) if isinstance(value, tuple) else value for key, value in items})
+
+
+def prepare_form(**params) -> Dict[str, Any]:
+    """
+    构建表单数据并缓存，批量提交相同参数时只构建一次
+    
+    返回的字典会被后续调用共享，调用方不应修改
+    """
+    items = tuple(sorted(
+        (key, tuple(value) if isinstance(value, list) else value) for key, value in params.items()
+    ))
+    return _cached_form_data(items)
+
+
+def iter_sse_events(chunks):
+    """
+    解析Server-Sent Events字节流，产出 (事件类型, 数据)
+    
+    换行解码器会保留块末尾的\r，跨块的\r\n不会被拆成两个换行
+    """
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(), translate=True)
+    event_type, data_lines, pending = 'message', [], ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            if not line:
+                # 空行表示一个事件结束
+                if data_lines:
+                    yield event_type, '\n'.join(data_lines)
+                event_type, data_lines = 'message', []
+                continue
+            field, _, value = line.partition(':')
+            if value.startswith(' '):
+                value = value[1:]
+            if field == 'event':
+                event_type = value
+            elif field == 'data':
+                data_lines.append(value)
+            # 以冒号开头的注释行（心跳）及其他字段忽略
+
+
+def download_filename(headers, job_id: str, filename: Optional[str] = None) -> str:
+    """从响应头获取下载文件名，支持RFC 5987编码的 filename*=utf-8''..."""
+    content_disposition = headers.get('content-disposition')
+    if content_disposition:
+        message = Message()
+        message['content-disposition'] = content_disposition
+        header_filename = message.get_filename()
+        if header_filename:
+            # 只保留文件名部分，不允许写到输出目录之外
+            return Path(header_filename).name
+    return filename or f"{job_id}_result"
+
 
 class MapperatorinatorClient:
     """Mapperatorinator API客户端"""
@@ -18,6 +183,22 @@ class MapperatorinatorClient:
     def __init__(self, base_url: str = "http://127.0.0.1:8000"):
         self.base_url = base_url.rstrip('/')
         self.session = requests.Session()
+        # 复用连接，网关错误时自动重试（默认不重试POST，避免重复提交任务）
+        adapter = HTTPAdapter(
+            pool_connections=POOL_SIZE,
+            pool_maxsize=POOL_SIZE,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+    
+    def check_connection(self) -> bool:
+        """检查API连接"""
+        try:
+            response = self.session.get(f"{self.base_url}/")
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
     
     def process_audio(
         self,
@@ -63,64 +244,56 @@ class MapperatorinatorClient:
         if not audio_path.exists():
             raise FileNotFoundError(f"音频文件不存在: {audio_file}")
         
-        # 准备文件
-        files = {
-            'audio_file': (audio_path.name, open(audio_path, 'rb'))
-        }
-        
         # 准备表单数据
-        data = {
-            'model': model,
-            'gamemode': gamemode,
-            'cfg_scale': cfg_scale,
-            'temperature': temperature,
-            'top_p': top_p,
-            'export_osz': export_osz,
-            'add_to_beatmap': add_to_beatmap,
-            'hitsounded': hitsounded,
-            'super_timing': super_timing
-        }
-        
-        # 添加可选参数
-        optional_params = {
-            'difficulty': difficulty,
-            'year': year,
-            'mapper_id': mapper_id,
-            'hp_drain_rate': hp_drain_rate,
-            'circle_size': circle_size,
-            'overall_difficulty': overall_difficulty,
-            'approach_rate': approach_rate,
-            'slider_multiplier': slider_multiplier,
-            'slider_tick_rate': slider_tick_rate,
-            'keycount': keycount,
-            'hold_note_ratio': hold_note_ratio,
-            'scroll_speed_ratio': scroll_speed_ratio,
-            'seed': seed,
-            'start_time': start_time,
-            'end_time': end_time
-        }
-        
-        for key, value in optional_params.items():
-            if value is not None:
-                data[key] = value
-        
-        # 添加列表参数
-        if descriptors:
-            data['descriptors'] = json.dumps(descriptors)
-        if negative_descriptors:
-            data['negative_descriptors'] = json.dumps(negative_descriptors)
-        
-        try:
-            response = self.session.post(
-                f"{self.base_url}/process",
-                files=files,
-                data=data
-            )
-            response.raise_for_status()
-            return response.json()
+        data = prepare_form(
+            model=model,
+            gamemode=gamemode,
+            difficulty=difficulty,
+            year=year,
+            mapper_id=mapper_id,
+            hp_drain_rate=hp_drain_rate,
+            circle_size=circle_size,
+            overall_difficulty=overall_difficulty,
+            approach_rate=approach_rate,
+            slider_multiplier=slider_multiplier,
+            slider_tick_rate=slider_tick_rate,
+            keycount=keycount,
+            hold_note_ratio=hold_note_ratio,
+            scroll_speed_ratio=scroll_speed_ratio,
+            cfg_scale=cfg_scale,
+            temperature=temperature,
+            top_p=top_p,
+            seed=seed,
+            start_time=start_time,
+            end_time=end_time,
+            export_osz=export_osz,
+            add_to_beatmap=add_to_beatmap,
+            hitsounded=hitsounded,
+            super_timing=super_timing,
+            descriptors=descriptors,
+            negative_descriptors=negative_descriptors
+        )
         
-        finally:
-            files['audio_file'][1].close()
+        with open(audio_path, 'rb') as audio:
+            if MultipartEncoder is not None:
+                # 边读边发送文件内容
+                encoder = MultipartEncoder(fields={
+                    **{key: str(value) for key, value in data.items()},
+                    'audio_file': (audio_path.name, audio, 'application/octet-stream')
+                })
+                response = self.session.post(
+                    f"{self.base_url}/process",
+                    data=encoder,
+                    headers={'Content-Type': encoder.content_type}
+                )
+            else:
+                response = self.session.post(
+                    f"{self.base_url}/process",
+                    files={'audio_file': (audio_path.name, audio)},
+                    data=data
+                )
+        response.raise_for_status()
+        return response.json()
     
     def get_status(self, job_id: str) -> Dict[str, Any]:
         """获取任务状态"""
@@ -143,16 +316,41 @@ class MapperatorinatorClient:
         )
         response.raise_for_status()
         
-        client = sseclient.SSEClient(response)
+        # 默认输出时批量写入终端，按间隔刷新，不为每一行单独刷新
+        write = sys.stdout.write
+        last_flush = time.monotonic()
+        try:
+            with response:
+                for event_type, data in iter_sse_events(response.iter_content(chunk_size=None)):
+                    if callback:
+                        callback(event_type, data)
+                    else:
+                        write("[{}] {}\n".format(event_type, data))
+                        now = time.monotonic()
+                        if now - last_flush >= STREAM_FLUSH_INTERVAL:
+                            sys.stdout.flush()
+                            last_flush = now
+                    
+                    if event_type in TERMINAL_EVENTS:
+                        break
+        finally:
+            sys.stdout.flush()
+    
+    def wait_for_progress_stream(self, job_id: str):
+        """订阅进度推送流，直到任务不再排队或运行"""
+        response = self.session.get(
+            f"{self.base_url}/jobs/{job_id}/progress/stream",
+            stream=True,
+            headers={'Accept': 'text/event-stream'}
+        )
+        response.raise_for_status()
         
-        for event in client.events():
-            if callback:
-                callback(event.event, event.data)
-            else:
-                print(f"[{event.event}] {event.data}")
-            
-            if event.event in ['completed', 'failed', 'error']:
-                break
+        with response:
+            for event_type, data in iter_sse_events(response.iter_content(chunk_size=None)):
+                if event_type == 'error':
+                    return
+                if event_type == 'progress' and json.loads(data)['status'] not in ('running', 'queued'):
+                    return
     
     def download_file(self, job_id: str, filename: Optional[str] = None, output_path: Optional[str] = None) -> str:
         """
@@ -166,33 +364,21 @@ class MapperatorinatorClient:
         Returns:
             下载的文件路径
         """
-        url = f"{self.base_url}/jobs/{job_id}/download"
-        if filename:
-            url += f"?filename={filename}"
-        
-        response = self.session.get(url)
-        response.raise_for_status()
+        # 文件名作为查询参数由requests编码，空格、&等字符不会破坏URL
+        params = {'filename': filename} if filename else None
         
-        # 获取文件名
-        if 'content-disposition' in response.headers:
-            content_disposition = response.headers['content-disposition']
-            if 'filename=' in content_disposition:
-                download_filename = content_disposition.split('filename=')[1].strip('"')
-            else:
-                download_filename = filename or f"{job_id}_result"
-        else:
-            download_filename = filename or f"{job_id}_result"
-        
-        # 确定保存路径
-        if output_path:
-            save_path = Path(output_path) / download_filename
-        else:
-            save_path = Path(download_filename)
-        
-        # 保存文件
-        save_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(save_path, 'wb') as f:
-            f.write(response.content)
+        # 流式下载，边接收边写入磁盘，不在内存中保留整个文件
+        with self.session.get(f"{self.base_url}/jobs/{job_id}/download", params=params, stream=True) as response:
+            response.raise_for_status()
+            
+            # 确定保存路径
+            save_path = Path(output_path or ".") / download_filename(response.headers, job_id, filename)
+            
+            # 保存文件
+            save_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(save_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
         
         return str(save_path)
     
@@ -214,17 +400,26 @@ class MapperatorinatorClient:
         response.raise_for_status()
         return response.json()['jobs']
     
-    def wait_for_completion(self, job_id: str, check_interval: float = 2.0) -> Dict[str, Any]:
+    def wait_for_completion(self, job_id: str, check_interval: float = 1.0,
+                            max_interval: float = MAX_POLL_INTERVAL) -> Dict[str, Any]:
         """
         等待任务完成
         
+        优先订阅进度推送流，任务结束时服务器立即推送；流不可用或中断时回退到轮询状态
+        
         Args:
             job_id: 任务ID
-            check_interval: 检查间隔（秒）
+            check_interval: 轮询时的初始检查间隔（秒），之后逐步增加
+            max_interval: 最大检查间隔（秒）
             
         Returns:
             最终状态
         """
+        try:
+            self.wait_for_progress_stream(job_id)
+        except requests.RequestException:
+            pass
+        
         while True:
             status = self.get_status(job_id)
             
@@ -232,6 +427,124 @@ class MapperatorinatorClient:
                 return status
             
             time.sleep(check_interval)
+            check_interval = min(max_interval, check_interval * POLL_BACKOFF)
+
+
+class AsyncMapperatorinatorClient:
+    """
+    Mapperatorinator API异步客户端 (httpx)
+    
+    服务器支持HTTP/2时，并发的状态查询、文件列表和下载复用同一个连接。
+    用法: async with AsyncMapperatorinatorClient() as client: ...
+    """
+    
+    def __init__(self, base_url: str = "http://127.0.0.1:8000", max_connections: int = 20,
+                 timeout: float = 30.0):
+        if httpx is None:
+            raise ImportError("缺少httpx包，安装: pip install 'httpx[http2]'")
+        self.base_url = base_url.rstrip('/')
+        self.client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout
+        )
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+    
+    async def aclose(self):
+        """关闭底层连接"""
+        await self.client.aclose()
+    
+    async def process_audio(self, audio_file: str, **params) -> Dict[str, Any]:
+        """
+        上传音频文件和参数开始处理
+        
+        Args:
+            audio_file: 音频文件路径
+            **params: 生成参数，与 MapperatorinatorClient.process_audio 相同
+            
+        Returns:
+            包含job_id的响应
+        """
+        audio_path = Path(audio_file)
+        if not audio_path.exists():
+            raise FileNotFoundError(f"音频文件不存在: {audio_file}")
+        
+        data = prepare_form(**params)
+        with open(audio_path, 'rb') as f:
+            response = await self.client.post(
+                f"{self.base_url}/process",
+                files={'audio_file': (audio_path.name, f)},
+                data=data
+            )
+        response.raise_for_status()
+        return response.json()
+    
+    async def submit_batch(self, audio_files: List[str], **params) -> List[Dict[str, Any]]:
+        """用相同参数并发提交多个音频文件，表单数据只构建一次"""
+        return await asyncio.gather(*(
+            self.process_audio(audio_file, **params) for audio_file in audio_files
+        ))
+    
+    async def get_status(self, job_id: str) -> Dict[str, Any]:
+        """获取任务状态"""
+        response = await self.client.get(f"{self.base_url}/jobs/{job_id}/status")
+        response.raise_for_status()
+        return response.json()
+    
+    async def download_file(self, job_id: str, filename: Optional[str] = None,
+                            output_path: Optional[str] = None) -> str:
+        """下载结果文件，边接收边写入磁盘"""
+        params = {'filename': filename} if filename else None
+        async with self.client.stream("GET", f"{self.base_url}/jobs/{job_id}/download", params=params) as response:
+            response.raise_for_status()
+            save_path = Path(output_path or ".") / download_filename(response.headers, job_id, filename)
+            save_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(save_path, 'wb') as f:
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+        return str(save_path)
+    
+    async def download_files(self, job_id: str, filenames: List[str],
+                             output_path: Optional[str] = None) -> List[str]:
+        """并发下载多个结果文件"""
+        return await asyncio.gather(*(
+            self.download_file(job_id, filename, output_path) for filename in filenames
+        ))
+    
+    async def list_files(self, job_id: str) -> List[Dict[str, Any]]:
+        """列出所有输出文件"""
+        response = await self.client.get(f"{self.base_url}/jobs/{job_id}/files")
+        response.raise_for_status()
+        return response.json()['files']
+    
+    async def cancel_job(self, job_id: str) -> Dict[str, Any]:
+        """取消任务"""
+        response = await self.client.post(f"{self.base_url}/jobs/{job_id}/cancel")
+        response.raise_for_status()
+        return response.json()
+    
+    async def list_jobs(self) -> List[Dict[str, Any]]:
+        """列出所有任务"""
+        response = await self.client.get(f"{self.base_url}/jobs")
+        response.raise_for_status()
+        return response.json()['jobs']
+    
+    async def wait_for_completion(self, job_id: str, check_interval: float = 1.0,
+                                  max_interval: float = MAX_POLL_INTERVAL) -> Dict[str, Any]:
+        """等待任务完成，返回最终状态（检查间隔逐步增加到max_interval）"""
+        while True:
+            status = await self.get_status(job_id)
+            
+            if status['status'] in ['completed', 'failed']:
+                return status
+            
+            await asyncio.sleep(check_interval)
+            check_interval = min(max_interval, check_interval * POLL_BACKOFF)
 
 
 def main():
@@ -300,11 +613,4 @@ def main():
 
 
 if __name__ == "__main__":
-    # 检查依赖
-    try:
-        import sseclient
-    except ImportError:
-        print("缺少sseclient-py包，安装: pip install sseclient-py")
-        sys.exit(1)
-    
     main()
@@ -4,159 +4,35 @@ Mapperatorinator API v2.0 完整使用示例
 演示如何上传音频文件，设置参数，监控进度，下载结果
 """
 
-import json
-import requests
 import time
-from pathlib import Path
-from typing import Optional, List
+from concurrent.futures import ThreadPoolExecutor
 
-class MapperatorinatorAPIClient:
-    """Mapperatorinator API客户端"""
-    
-    def __init__(self, base_url: str = "http://127.0.0.1:8000"):
-        self.base_url = base_url.rstrip('/')
-        self.session = requests.Session()
-        
-    def check_connection(self) -> bool:
-        """检查API连接"""
-        try:
-            response = self.session.get(f"{self.base_url}/")
-            return response.status_code == 200
-        except:
-            return False
-    
-    def process_audio(
-        self,
-        audio_file_path: str,
-        model: str = "v30",
-        gamemode: int = 0,
-        difficulty: Optional[float] = None,
-        descriptors: Optional[List[str]] = None,
-        negative_descriptors: Optional[List[str]] = None,
-        **kwargs
-    ) -> dict:
-        """
-        处理音频文件
-        
-        Args:
-            audio_file_path: 音频文件路径
-            model: 模型配置名称 (v30, v31, default等)
-            gamemode: 游戏模式 (0=osu!, 1=taiko, 2=catch, 3=mania)
-            difficulty: 目标难度
-            descriptors: 风格描述符列表
-            negative_descriptors: 负面描述符列表
-            **kwargs: 其他参数
-            
-        Returns:
-            包含job_id的响应
-        """
-        file_path = Path(audio_file_path)
-        if not file_path.exists():
-            raise FileNotFoundError(f"音频文件不存在: {audio_file_path}")
-        
-        # 准备文件
-        files = {
-            'audio_file': (file_path.name, open(file_path, 'rb'))
-        }
-        
-        # 准备基本参数
-        data = {
-            'model': model,
-            'gamemode': gamemode,
-        }
-        
-        # 添加可选参数
-        if difficulty is not None:
-            data['difficulty'] = difficulty
-            
-        # 处理JSON参数
-        if descriptors:
-            data['descriptors'] = json.dumps(descriptors)
-        if negative_descriptors:
-            data['negative_descriptors'] = json.dumps(negative_descriptors)
-        
-        # 添加其他kwargs参数
-        for key, value in kwargs.items():
-            if value is not None:
-                data[key] = value
-        
-        try:
-            response = self.session.post(
-                f"{self.base_url}/process",
-                files=files,
-                data=data
-            )
-            response.raise_for_status()
-            return response.json()
-        
-        finally:
-            files['audio_file'][1].close()
-    
-    def get_status(self, job_id: str) -> dict:
-        """获取任务状态"""
-        response = self.session.get(f"{self.base_url}/jobs/{job_id}/status")
-        response.raise_for_status()
-        return response.json()
-    
-    def wait_for_completion(self, job_id: str, timeout: int = 600, check_interval: int = 5) -> dict:
-        """
-        等待任务完成
-        
-        Args:
-            job_id: 任务ID
-            timeout: 超时时间（秒）
-            check_interval: 检查间隔（秒）
-            
-        Returns:
-            最终状态
-        """
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            status = self.get_status(job_id)
-            
-            print(f"📊 任务状态: {status['status']} - {status.get('message', '')}")
-            
-            if status['status'] in ['completed', 'failed']:
-                return status
-            
-            time.sleep(check_interval)
-        
-        raise TimeoutError(f"任务 {job_id} 在 {timeout} 秒内未完成")
+from client_v2 import MapperatorinatorClient, MAX_POLL_INTERVAL, POLL_BACKOFF
+
+# 并发下载的线程数，不超过客户端连接池大小
+DOWNLOAD_WORKERS = 8
+
+# 等待任务完成的超时时间（秒）
+WAIT_TIMEOUT = 600
+
+
+def wait_with_status(client, job_id, timeout=WAIT_TIMEOUT, check_interval=1.0):
+    """轮询任务状态并逐次输出，直到完成、失败或超时"""
+    deadline = time.time() + timeout
     
-    def download_file(self, job_id: str, filename: Optional[str] = None, output_dir: str = ".") -> str:
-        """下载结果文件"""
-        url = f"{self.base_url}/jobs/{job_id}/download"
-        if filename:
-            url += f"?filename={filename}"
-        
-        response = self.session.get(url)
-        response.raise_for_status()
+    while time.time() < deadline:
+        status = client.get_status(job_id)
         
-        # 获取文件名
-        if 'content-disposition' in response.headers:
-            content_disposition = response.headers['content-disposition']
-            if 'filename=' in content_disposition:
-                download_filename = content_disposition.split('filename=')[1].strip('"')
-            else:
-                download_filename = filename or f"{job_id}_result"
-        else:
-            download_filename = filename or f"{job_id}_result"
+        print(f"📊 任务状态: {status['status']} - {status.get('message', '')}")
         
-        # 保存文件
-        output_path = Path(output_dir) / download_filename
-        output_path.parent.mkdir(parents=True, exist_ok=True)
+        if status['status'] in ['completed', 'failed']:
+            return status
         
-        with open(output_path, 'wb') as f:
-            f.write(response.content)
-        
-        return str(output_path)
+        # 不越过超时时间
+        time.sleep(max(0.0, min(check_interval, deadline - time.time())))
+        check_interval = min(MAX_POLL_INTERVAL, check_interval * POLL_BACKOFF)
     
-    def list_files(self, job_id: str) -> List[dict]:
-        """列出输出文件"""
-        response = self.session.get(f"{self.base_url}/jobs/{job_id}/files")
-        response.raise_for_status()
-        return response.json()['files']
+    raise TimeoutError(f"任务 {job_id} 在 {timeout} 秒内未完成")
 
 
 def main():
@@ -178,7 +54,7 @@ def main():
     print("=" * 40)
     
     # 创建客户端
-    client = MapperatorinatorAPIClient(args.server)
+    client = MapperatorinatorClient(args.server)
     
     # 检查连接
     print("🔗 检查API连接...")
@@ -194,7 +70,7 @@ def main():
         print(f"\n🎵 上传音频文件: {args.audio_file}")
         
         result = client.process_audio(
-            audio_file_path=args.audio_file,
+            audio_file=args.audio_file,
             model=args.model,
             gamemode=args.gamemode,
             difficulty=args.difficulty,
@@ -207,7 +83,7 @@ def main():
         
         # 等待完成
         print(f"\n⏳ 等待处理完成...")
-        final_status = client.wait_for_completion(job_id)
+        final_status = wait_with_status(client, job_id)
         
         if final_status['status'] == 'completed':
             print("\n🎉 处理完成!")
@@ -222,16 +98,22 @@ def main():
             # 下载文件
             if files:
                 print(f"\n⬇️ 下载文件到: {args.output_dir}")
-                for file_info in files:
+                
+                def download(file_info):
                     try:
                         download_path = client.download_file(
                             job_id, 
                             file_info['name'], 
                             args.output_dir
                         )
-                        print(f"  ✅ {download_path}")
+                        return f"  ✅ {download_path}"
                     except Exception as e:
-                        print(f"  ❌ 下载 {file_info['name']} 失败: {e}")
+                        return f"  ❌ 下载 {file_info['name']} 失败: {e}"
+                
+                # 多个文件并发下载，按原顺序输出结果
+                with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+                    for message in executor.map(download, files):
+                        print(message)
                 
                 print(f"\n🎯 下载完成! 文件保存在: {args.output_dir}")
             else:
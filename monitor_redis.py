@@ -4,7 +4,10 @@ Redis缓存监控脚本
 用于监控Mapperatorinator API的Redis缓存使用情况
 """
 
+import atexit
 import json
+import os
+import sys
 import time
 import argparse
 from typing import Dict, Any, Optional, Union
@@ -16,10 +19,29 @@ except ImportError:
     print("❌ 请安装redis包: pip install redis")
     exit(1)
 
-def connect_redis(host: str = 'localhost', port: int = 6379, db: int = 1) -> Optional[redis.Redis]:
-    """连接Redis"""
+# SCAN每批返回的键数量，以及批量UNLINK的大小
+SCAN_COUNT = 500
+DELETE_BATCH_SIZE = 500
+
+def default_max_connections() -> int:
+    """连接池默认上限：CPU核数的两倍，至少8个"""
+    return max(8, 2 * (os.cpu_count() or 1))
+
+def connect_redis(host: str = 'localhost', port: int = 6379, db: int = 1,
+                  max_connections: Optional[int] = None) -> Optional[redis.Redis]:
+    """连接Redis（有上限的阻塞连接池，连接用尽时排队等待而不是新建连接）"""
     try:
-        r = redis.Redis(host=host, port=port, db=db, decode_responses=True)
+        pool = redis.BlockingConnectionPool(
+            host=host,
+            port=port,
+            db=db,
+            max_connections=max_connections or default_max_connections(),
+            timeout=5,
+            decode_responses=True,
+            socket_keepalive=True,
+            health_check_interval=30
+        )
+        r = redis.Redis(connection_pool=pool)
         r.ping()
         print(f"✅ 连接到Redis成功: {host}:{port} (db={db})")
         return r
@@ -39,82 +61,111 @@ def get_cache_stats(r: redis.Redis) -> Dict[str, Any]:
     for prefix in prefixes:
         pattern = f"{prefix}:*"
         try:
-            keys = r.keys(pattern)
-            if isinstance(keys, (list, tuple)):
-                stats[prefix] = {
-                    "count": len(keys),
-                    "keys": keys[:5]  # 显示前5个键作为示例
-                }
-            else:
-                stats[prefix] = {"count": 0, "keys": []}
+            # SCAN分批遍历，不像KEYS那样长时间阻塞Redis
+            count = 0
+            sample_keys = []
+            for key in r.scan_iter(match=pattern, count=SCAN_COUNT):
+                count += 1
+                if len(sample_keys) < 5:  # 显示前5个键作为示例
+                    sample_keys.append(key)
+            stats[prefix] = {
+                "count": count,
+                "keys": sample_keys
+            }
         except redis.exceptions.RedisError:
             stats[prefix] = {"count": 0, "keys": []}
     
-    # 获取Redis内存使用情况
+    # 内存使用、命令统计和总键数通过一次管道往返获取，只请求需要的INFO部分
     try:
-        info = r.info()
-        if isinstance(info, dict):
-            stats["memory"] = {
-                "used_memory_human": info.get("used_memory_human", "N/A"),
-                "used_memory_peak_human": info.get("used_memory_peak_human", "N/A"),
-                "total_commands_processed": info.get("total_commands_processed", 0)
-            }
+        pipe = r.pipeline(transaction=False)
+        pipe.info("memory")
+        pipe.info("stats")
+        pipe.dbsize()
+        memory_info, stats_info, total_keys = pipe.execute()
+        stats["memory"] = {
+            "used_memory_human": memory_info.get("used_memory_human", "N/A"),
+            "used_memory_peak_human": memory_info.get("used_memory_peak_human", "N/A"),
+            "total_commands_processed": stats_info.get("total_commands_processed", 0)
+        }
+        stats["total_keys"] = total_keys
     except redis.exceptions.RedisError:
         stats["memory"] = {"used_memory_human": "N/A", "used_memory_peak_human": "N/A", "total_commands_processed": 0}
-    
-    # 获取总键数
-    try:
-        stats["total_keys"] = r.dbsize()
-    except redis.exceptions.RedisError:
         stats["total_keys"] = 0
     
     return stats
 
+def restore_cursor():
+    """恢复终端光标显示"""
+    sys.stdout.write("\033[?25h")
+    sys.stdout.flush()
+
 def monitor_cache(r: redis.Redis, interval: int = 10):
     """持续监控缓存"""
     print(f"🔍 开始监控Redis缓存 (每{interval}秒刷新)...")
     print("按Ctrl+C退出\n")
     
+    # 只在第一次清屏并隐藏光标，之后回到左上角原地覆盖，避免整屏重绘闪烁
+    sys.stdout.write("\033[?25l\033[2J")
+    atexit.register(restore_cursor)
+    
     try:
         while True:
             stats = get_cache_stats(r)
             
-            # 清屏
-            print("\033[2J\033[H", end="")
-            
             # 显示时间戳
-            print(f"📊 Redis缓存监控 - {time.strftime('%Y-%m-%d %H:%M:%S')}")
-            print("=" * 60)
+            lines = [
+                f"📊 Redis缓存监控 - {time.strftime('%Y-%m-%d %H:%M:%S')}",
+                "=" * 60
+            ]
             
             # 显示内存使用
             if "memory" in stats:
                 memory = stats["memory"]
-                print(f"💾 内存使用: {memory['used_memory_human']}")
-                print(f"📈 峰值内存: {memory['used_memory_peak_human']}")
-                print(f"🔢 总命令数: {memory['total_commands_processed']}")
-                print()
+                lines.append(f"💾 内存使用: {memory['used_memory_human']}")
+                lines.append(f"📈 峰值内存: {memory['used_memory_peak_human']}")
+                lines.append(f"🔢 总命令数: {memory['total_commands_processed']}")
+                lines.append("")
             
             # 显示总键数
-            print(f"🔑 总键数: {stats.get('total_keys', 0)}")
-            print()
+            lines.append(f"🔑 总键数: {stats.get('total_keys', 0)}")
+            lines.append("")
             
             # 显示各类型缓存统计
             for prefix in ["job_progress", "job_metadata", "output_files", "model_config"]:
                 if prefix in stats:
                     cache_info = stats[prefix]
                     count = cache_info['count']
-                    print(f"📋 {prefix}: {count} 个缓存项")
+                    lines.append(f"📋 {prefix}: {count} 个缓存项")
                     if cache_info['keys']:
-                        print(f"   示例键: {cache_info['keys'][:3]}")
+                        lines.append(f"   示例键: {cache_info['keys'][:3]}")
+            
+            lines.append("")
+            lines.append("=" * 60)
+            lines.append("按Ctrl+C退出")
             
-            print("\n" + "=" * 60)
-            print("按Ctrl+C退出")
+            # 每行清除到行尾，最后清除屏幕剩余部分，一次写入后刷新
+            sys.stdout.write("\033[H" + "".join(line + "\033[K\n" for line in lines) + "\033[J")
+            sys.stdout.flush()
             
             time.sleep(interval)
             
     except KeyboardInterrupt:
+        restore_cursor()
         print("\n👋 监控已停止")
 
+def delete_matching_keys(r: redis.Redis, pattern: str) -> int:
+    """用SCAN查找匹配的键并分批UNLINK（后台释放内存），返回删除数量"""
+    deleted = 0
+    batch = []
+    for key in r.scan_iter(match=pattern, count=SCAN_COUNT):
+        batch.append(key)
+        if len(batch) >= DELETE_BATCH_SIZE:
+            deleted += r.unlink(*batch)
+            batch.clear()
+    if batch:
+        deleted += r.unlink(*batch)
+    return deleted
+
 def clear_cache(r: redis.Redis, pattern: Optional[str] = None):
     """清理缓存"""
     if not r:
@@ -122,9 +173,8 @@ def clear_cache(r: redis.Redis, pattern: Optional[str] = None):
     
     if pattern:
         try:
-            keys = r.keys(pattern)
-            if isinstance(keys, (list, tuple)) and keys:
-                deleted = r.delete(*keys)
+            deleted = delete_matching_keys(r, pattern)
+            if deleted:
                 print(f"🗑️ 删除了 {deleted} 个匹配 '{pattern}' 的键")
             else:
                 print(f"🤷 没有找到匹配 '{pattern}' 的键")
@@ -136,11 +186,9 @@ def clear_cache(r: redis.Redis, pattern: Optional[str] = None):
         total_deleted = 0
         for pattern in job_patterns:
             try:
-                keys = r.keys(pattern)
-                if isinstance(keys, (list, tuple)) and keys:
-                    deleted = r.delete(*keys)
-                    if isinstance(deleted, int):
-                        total_deleted += deleted
+                deleted = delete_matching_keys(r, pattern)
+                if deleted:
+                    total_deleted += deleted
                     print(f"🗑️ 删除了 {deleted} 个 '{pattern}' 键")
             except redis.exceptions.RedisError as e:
                 print(f"❌ 删除 '{pattern}' 失败: {e}")
@@ -152,6 +200,7 @@ def main():
     parser.add_argument("--host", default="localhost", help="Redis主机")
     parser.add_argument("--port", type=int, default=6379, help="Redis端口")
     parser.add_argument("--db", type=int, default=1, help="Redis数据库")
+    parser.add_argument("--max-connections", type=int, default=default_max_connections(), help="连接池最大连接数")
     parser.add_argument("--interval", type=int, default=10, help="监控刷新间隔(秒)")
     parser.add_argument("--clear", help="清理缓存 (可指定模式，如 'job_progress:*')")
     parser.add_argument("--stats", action="store_true", help="显示一次性统计信息")
@@ -159,7 +208,7 @@ def main():
     args = parser.parse_args()
     
     # 连接Redis
-    r = connect_redis(args.host, args.port, args.db)
+    r = connect_redis(args.host, args.port, args.db, args.max_connections)
     if not r:
         return
     
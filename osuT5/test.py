@@ -8,7 +8,7 @@ import torch
 import wandb
 from accelerate import Accelerator
 from accelerate.logging import get_logger
-from accelerate.utils import ProjectConfiguration
+from accelerate.utils import ProjectConfiguration, set_seed
 from torch import nn
 from tqdm import tqdm
 
@@ -21,7 +21,7 @@ from osuT5.tokenizer import EventType, Tokenizer
 from osuT5.utils import (
     setup_args,
     get_model,
-    get_dataloaders, Averager, add_prefix, acc_range, fuzzy_acc_range,
+    get_dataloaders, Averager, add_prefix,
     get_shared_training_state,
 )
 
@@ -31,7 +31,6 @@ logger = get_logger(__name__)
 def load_model(
         ckpt_path_str: str,
         t5_args: TrainConfig,
-        device,
 ):
     if ckpt_path_str == "":
         raise ValueError("Model path is empty.")
@@ -54,19 +53,21 @@ def load_model(
             model = Mapperatorinator.from_pretrained(ckpt_path_str)
             model.generation_config.disable_compile = True
         else:
-            model_state = torch.load(ckpt_path / "pytorch_model.bin", map_location=device, weights_only=True)
+            model_state = torch.load(ckpt_path / "pytorch_model.bin", map_location="cpu", weights_only=True)
             model = get_model(t5_args, tokenizer)
             model.load_state_dict(model_state)
 
+        # Device placement is left to accelerator.prepare
         model.eval()
-        model.to(device)
         return model
 
     return model_loader(), tokenizer
 
 
 def test(args: TrainConfig, accelerator: Accelerator, model, tokenizer, preprefix: str):
-    setup_args(args)
+    # Re-seed so every test run sees the same data order regardless of what ran before
+    if args.seed is not None:
+        set_seed(args.seed)
 
     shared = get_shared_training_state()
     shared.current_train_step = args.optim.total_steps
@@ -76,10 +77,9 @@ def test(args: TrainConfig, accelerator: Accelerator, model, tokenizer, preprefi
     # noinspection PyTypeChecker
     test_dataloader = accelerator.prepare(test_dataloader)
 
-    class_weights = torch.ones(tokenizer.vocab_size_out)
+    class_weights = torch.ones(tokenizer.vocab_size_out, device=accelerator.device)
     class_weights[tokenizer.event_start[EventType.TIME_SHIFT]:tokenizer.event_end[EventType.TIME_SHIFT]] = args.data.rhythm_weight
     loss_fn = nn.CrossEntropyLoss(weight=class_weights, reduction="none", ignore_index=LABEL_IGNORE_ID)
-    loss_fn = loss_fn.to(accelerator.device)
 
     all_in_contexts = set()
     for cts in args.data.context_types:
@@ -88,18 +88,35 @@ def test(args: TrainConfig, accelerator: Accelerator, model, tokenizer, preprefi
         else:
             all_in_contexts.update(cts["in"])
 
-    with torch.no_grad():
+    # Column of each input context in the per-sample context presence matrix, and the
+    # columns and metric prefix of each context type group, computed once instead of per batch
+    context_columns = {c: i for i, c in enumerate(all_in_contexts)}
+    context_sos_ids = torch.tensor([tokenizer.context_sos[c] for c in all_in_contexts], dtype=torch.long,
+                                   device=accelerator.device)
+    context_groups = []
+    for cts in args.data.context_types:
+        if isinstance(cts, str):
+            cts = {"out": [ContextType.MAP], "in": [cts]}
+        required_cols = [context_columns[c] for c in cts["in"]]
+        excluded_cols = [context_columns[c] for c in all_in_contexts - set(cts["in"])]
+        # noinspection PyUnresolvedReferences
+        c_prefix = f"{'+'.join(c.value for c in cts['in'])}"
+        context_groups.append((required_cols, excluded_cols, c_prefix))
+
+    with torch.inference_mode():
         start_time = time.time()
         averager = Averager()
 
         max_time = 1000 * args.data.src_seq_len * args.model.spectrogram.hop_length / args.model.spectrogram.sample_rate
         n_bins = 100
         bins = np.linspace(0, max_time, n_bins + 1)[1:]
+        inv_time_bin = n_bins / max_time
         bin_totals = {}
         bin_counts = {}
         max_rhythm_complexity = 4
         rhythm_complexity_n_bins = 20
         rhythm_complexity_bins = np.linspace(0, max_rhythm_complexity, rhythm_complexity_n_bins + 1)[1:]
+        inv_rhythm_complexity_bin = rhythm_complexity_n_bins / max_rhythm_complexity
         rhythm_complexity_bin_totals = {}
         rhythm_complexity_bin_counts = {}
         fuzzy_rhythm_complexity_bin_totals = {}
@@ -108,6 +125,103 @@ def test(args: TrainConfig, accelerator: Accelerator, model, tokenizer, preprefi
         precision_bin_totals = {}
         precision_bin_counts = {}
 
+        # Lookup table from time shift token to time in milliseconds, so label times can be computed without decoding
+        time_shift_start = tokenizer.event_start[EventType.TIME_SHIFT]
+        time_shift_end = tokenizer.event_end[EventType.TIME_SHIFT]
+        time_shift_values = ((tokenizer.event_range[EventType.TIME_SHIFT].min_value +
+                              np.arange(time_shift_end - time_shift_start)) / STEPS_PER_MILLISECOND)
+
+        # Reused pinned host buffers for copying predictions to the CPU without blocking.
+        # Token ids are copied as int16 when ids, the ignore label and their differences fit, to cut transfer and scan size.
+        host_buffers = {}
+        token_dtype = torch.int16 if tokenizer.vocab_size_out + abs(LABEL_IGNORE_ID) < 2 ** 15 else torch.int32
+
+        def to_host(name, tensor):
+            if tensor.device.type != "cuda":
+                return tensor.detach().cpu()
+            buffer = host_buffers.get(name)
+            if buffer is None or buffer.shape != tensor.shape or buffer.dtype != tensor.dtype:
+                buffer = host_buffers[name] = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+            buffer.copy_(tensor, non_blocking=True)
+            return buffer
+
+        def accumulate_histograms(preds_host, labels_host, rhythm_complexity_host, groups, copied):
+            if copied is not None:
+                copied.synchronize()
+
+            # Token-level metric inputs are computed once for the whole batch and shared by all context types
+            preds_np = preds_host.numpy()
+            labels_np = labels_host.numpy()
+            is_time = (time_shift_start <= labels_np) & (labels_np < time_shift_end)
+            timing_diffs = preds_np - labels_np
+            correct = preds_np == labels_np
+            valid = (labels_np != LABEL_IGNORE_ID) & (labels_np != tokenizer.eos_id)
+            valid_rows = valid.any(axis=1)
+
+            # Each label gets the time of the last time shift token at or before it, or 0 if there is none
+            last_time_pos = np.where(is_time, np.arange(labels_np.shape[1]), -1)
+            np.maximum.accumulate(last_time_pos, axis=1, out=last_time_pos)
+            last_time_tokens = np.take_along_axis(labels_np, np.maximum(last_time_pos, 0), axis=1)
+            last_time_tokens = np.clip(last_time_tokens - time_shift_start, 0, len(time_shift_values) - 1)
+            label_times = np.where(last_time_pos >= 0, time_shift_values[last_time_tokens], 0).astype(np.float32)
+
+            # Bins are uniform, so the bin index is a multiply and cast instead of a binary search.
+            # Times past max_time land in bin n_bins, which is not counted.
+            binned_labels = np.clip((label_times * inv_time_bin).astype(np.int64), 0, n_bins)
+
+            # Per-sample timing accuracy for binning by rhythm complexity
+            if rhythm_complexity_host is not None:
+                binned_rhythm_complexity = np.clip((rhythm_complexity_host.numpy() * inv_rhythm_complexity_bin).astype(np.int64),
+                                                   0, rhythm_complexity_n_bins - 1)
+                # Row sums over the time shift labels, equivalent to acc_range and fuzzy_acc_range with a fuzzyness of 2
+                sample_totals = np.count_nonzero(correct & is_time, axis=1)
+                sample_counts = np.count_nonzero(is_time, axis=1)
+                fuzzy_sample_totals = np.count_nonzero(is_time & (np.abs(timing_diffs) <= 2), axis=1)
+
+            for prefix, rows in groups:
+                # Initialize bin totals for this prefix
+                if prefix not in bin_totals:
+                    bin_totals[prefix] = np.zeros(n_bins)
+                    bin_counts[prefix] = np.zeros(n_bins)
+                    rhythm_complexity_bin_totals[prefix] = np.zeros(rhythm_complexity_n_bins)
+                    rhythm_complexity_bin_counts[prefix] = np.zeros(rhythm_complexity_n_bins)
+                    fuzzy_rhythm_complexity_bin_totals[prefix] = np.zeros(rhythm_complexity_n_bins)
+                    precision_bin_totals[prefix] = np.zeros(2 * precision_bin_range + 1)
+                    precision_bin_counts[prefix] = np.zeros(2 * precision_bin_range + 1)
+
+                # Time shift labels are always valid, so a context without valid tokens adds nothing to any histogram
+                if not (rows & valid_rows).any():
+                    continue
+
+                token_rows = rows[:, None]
+
+                # Calculate timing precision histogram
+                # Each bin holds the fraction of all timing predictions that are off by exactly that offset
+                row_timing_diffs = timing_diffs[is_time & token_rows]
+                in_range = np.abs(row_timing_diffs) <= precision_bin_range
+                precision_bin_totals[prefix] += np.bincount(row_timing_diffs[in_range] + precision_bin_range,
+                                                            minlength=2 * precision_bin_range + 1)
+                precision_bin_counts[prefix] += len(row_timing_diffs)
+
+                # Bin labels by time and calculate accuracy
+                selected = valid & token_rows
+                valid_bins = binned_labels[selected]
+                bin_totals[prefix] += np.bincount(valid_bins, weights=correct[selected], minlength=n_bins + 1)[:n_bins]
+                bin_counts[prefix] += np.bincount(valid_bins, minlength=n_bins + 1)[:n_bins]
+
+                # Bin timing accuracy by rhythm complexity
+                if rhythm_complexity_host is not None:
+                    row_bins = binned_rhythm_complexity[rows]
+                    rhythm_complexity_bin_totals[prefix] += np.bincount(row_bins, weights=sample_totals[rows],
+                                                                        minlength=rhythm_complexity_n_bins)
+                    rhythm_complexity_bin_counts[prefix] += np.bincount(row_bins, weights=sample_counts[rows],
+                                                                        minlength=rhythm_complexity_n_bins)
+                    fuzzy_rhythm_complexity_bin_totals[prefix] += np.bincount(row_bins, weights=fuzzy_sample_totals[rows],
+                                                                              minlength=rhythm_complexity_n_bins)
+
+        # Histogram work of the previous batch, done while the GPU runs the next forward pass
+        pending = None
+
         for batch_id, batch in enumerate(tqdm(test_dataloader), start=1):  # type: int, dict[str, torch.Tensor]
             if batch_id == args.eval.steps * args.optim.grad_acc:
                 break
@@ -120,102 +234,65 @@ def test(args: TrainConfig, accelerator: Accelerator, model, tokenizer, preprefi
             del batch["beatmap_idx"]
 
             outputs = model(**batch)
+
+            if pending is not None:
+                accumulate_histograms(*pending)
+                pending = None
+
             loss = outputs.loss
-            preds = torch.argmax(outputs.logits, dim=-1)
+            logits = outputs.logits
+            del outputs
+            if logits.device.type == "cpu" and logits.dtype != torch.bfloat16:
+                # NumPy's argmax is faster than torch's on CPU
+                preds = torch.from_numpy(np.argmax(logits.numpy(), axis=-1))
+            else:
+                preds = torch.argmax(logits, dim=-1)
             labels = batch["labels"]
 
-            def gather_metrics(loss, preds, labels, rhythm_complexity=None, prefix=''):
+            # Start copying to the host now and only wait for it when the histograms are accumulated
+            preds_host = to_host("preds", preds.to(token_dtype))
+            labels_host = to_host("labels", labels.to(token_dtype))
+            rhythm_complexity_host = to_host("rhythm_complexity", rhythm_complexity) if rhythm_complexity is not None else None
+            copied = None
+            if preds.device.type == "cuda":
+                copied = torch.cuda.Event()
+                copied.record()
+            groups = []
+
+            def gather_metrics(loss, preds, labels, rows, prefix=''):
                 # Calculate accuracy metrics
                 stats = get_stats(loss, preds, labels, tokenizer, args)
                 stats = add_prefix(prefix, stats)
 
                 averager.update(stats)
-
-                # Initialize bin totals for this prefix
-                if prefix not in bin_totals:
-                    bin_totals[prefix] = np.zeros(n_bins)
-                    bin_counts[prefix] = np.zeros(n_bins)
-                    rhythm_complexity_bin_totals[prefix] = np.zeros(rhythm_complexity_n_bins)
-                    rhythm_complexity_bin_counts[prefix] = np.zeros(rhythm_complexity_n_bins)
-                    fuzzy_rhythm_complexity_bin_totals[prefix] = np.zeros(rhythm_complexity_n_bins)
-                    precision_bin_totals[prefix] = np.zeros(2 * precision_bin_range + 1)
-                    precision_bin_counts[prefix] = np.zeros(2 * precision_bin_range + 1)
-
-                # Calculate timing precision histogram
-                index = (tokenizer.event_start[EventType.TIME_SHIFT] <= labels) & (labels < tokenizer.event_end[EventType.TIME_SHIFT])
-                range_labels = labels[index]
-                range_preds = preds[index]
-                timing_diffs = (range_preds - range_labels).detach().cpu().numpy()
-                for i, n in enumerate(precision_bins):  # type: int, int
-                    accs = timing_diffs == n
-                    precision_bin_totals[prefix][i] += np.sum(accs)
-                    # noinspection PyTypeChecker
-                    precision_bin_counts[prefix][i] += len(accs)
-
-                # Bin labels by time and calculate accuracy
-                preds = preds.detach().cpu().numpy()
-                labels = labels.detach().cpu().numpy()
-                label_times = np.empty(labels.shape, dtype=np.float32)
-                for j in range(len(labels)):
-                    t = 0
-                    for i, l in enumerate(labels[j]):
-                        if tokenizer.event_start[EventType.TIME_SHIFT] <= l < tokenizer.event_end[EventType.TIME_SHIFT]:
-                            time_event = tokenizer.decode(l)
-                            t = time_event.value / STEPS_PER_MILLISECOND
-                        label_times[j, i] = t
-
-                binned_labels = np.digitize(label_times, bins)
-                for i in range(n_bins):
-                    bin_preds = preds[binned_labels == i]
-                    bin_labels = labels[binned_labels == i]
-                    index = (bin_labels != LABEL_IGNORE_ID) & (bin_labels != tokenizer.eos_id)
-                    bin_preds = bin_preds[index]
-                    bin_labels = bin_labels[index]
-                    bin_totals[prefix][i] += np.sum(bin_preds == bin_labels)
-                    bin_counts[prefix][i] += len(bin_preds)
-
-                # Bin timing accuracy by rhythm complexity
-                if rhythm_complexity is not None:
-                    rhythm_complexity = rhythm_complexity.cpu().numpy()
-                    binned_rhythm_complexity = np.digitize(rhythm_complexity, rhythm_complexity_bins)
-                    for i in range(len(rhythm_complexity)):
-                        sample_bin = np.clip(binned_rhythm_complexity[i], 0, n_bins - 1)
-                        sample = acc_range(preds[i], labels[i], tokenizer.event_start[EventType.TIME_SHIFT],
-                                           tokenizer.event_end[EventType.TIME_SHIFT])
-                        fuzzy_sample = fuzzy_acc_range(preds[i], labels[i], tokenizer.event_start[EventType.TIME_SHIFT],
-                                                       tokenizer.event_end[EventType.TIME_SHIFT], 2)
-                        rhythm_complexity_bin_totals[prefix][sample_bin] += np.sum(sample)
-                        rhythm_complexity_bin_counts[prefix][sample_bin] += len(sample)
-                        fuzzy_rhythm_complexity_bin_totals[prefix][sample_bin] += np.sum(fuzzy_sample)
+                groups.append((prefix, rows))
 
             if len(args.data.context_types) > 0:
-                for cts in args.data.context_types:
-                    if isinstance(cts, str):
-                        cts = {"out": [ContextType.MAP], "in": [cts]}
-
-                    ct_index = torch.ones_like(batch['decoder_input_ids'][:, 0], dtype=torch.bool)
-                    for c in cts["in"]:
-                        ct_index &= torch.max(batch['decoder_input_ids'] ==
-                                              tokenizer.context_sos[c], dim=1).values
-                    for c in all_in_contexts - set(cts["in"]):
-                        ct_index &= ~torch.max(batch['decoder_input_ids'] ==
-                                               tokenizer.context_sos[c], dim=1).values
+                # Which context SOS tokens appear in each sample, in a single comparison pass
+                decoder_input_ids = batch['decoder_input_ids']
+                presence = (decoder_input_ids.unsqueeze(-1) == context_sos_ids.to(decoder_input_ids.device)).any(dim=1)
+
+                for required_cols, excluded_cols, c_prefix in context_groups:
+                    ct_index = presence[:, required_cols].all(dim=1) & ~presence[:, excluded_cols].any(dim=1)
 
                     if not ct_index.any():
                         continue
 
-                    ct_logits = outputs.logits[ct_index]
-                    ct_preds = preds[ct_index]
+                    # Index the logits inline so no slice of them outlives this group
                     ct_labels = labels[ct_index]
-                    ct_weights = batch["sample_weights"][ct_index]
-                    ct_rhythm_complexity = rhythm_complexity[ct_index] if rhythm_complexity is not None else None
-                    ct_loss = calc_loss(loss_fn, ct_logits, ct_labels, ct_weights)
+                    ct_loss = calc_loss(loss_fn, logits[ct_index], ct_labels, batch["sample_weights"][ct_index])
 
-                    # noinspection PyUnresolvedReferences
-                    c_prefix = f"{'+'.join(c.value for c in cts['in'])}"
-                    gather_metrics(ct_loss, ct_preds, ct_labels, ct_rhythm_complexity, prefix=c_prefix)
+                    gather_metrics(ct_loss, preds[ct_index], ct_labels, ct_index.cpu().numpy(), prefix=c_prefix)
             else:
-                gather_metrics(loss, preds, labels, rhythm_complexity)
+                gather_metrics(loss, preds, labels, np.ones(len(labels), dtype=bool))
+
+            pending = (preds_host, labels_host, rhythm_complexity_host, groups, copied)
+
+            # Release the logits before the next forward pass so two batches of logits are never alive at once
+            del logits
+
+        if pending is not None:
+            accumulate_histograms(*pending)
 
         def plot_bins(bin_totals, bin_counts, bins, y_name, x_name, prefixes):
             for prefix in reversed(prefixes):
@@ -225,13 +302,13 @@ def test(args: TrainConfig, accelerator: Accelerator, model, tokenizer, preprefi
                 y_name = f"{prefix}/{y_name}"
 
             bin_accs = bin_totals / bin_counts
-            wandb.define_metric(y_name, step_metric=x_name)
 
-            # Log the plot
-            for (bin_x, bin_acc) in zip(bins, bin_accs):
-                if not np.isnan(bin_acc):
-                    wandb.log({y_name: bin_acc, x_name: bin_x})
+            # Collect the series as one table so every plot goes out in a single log call
+            data = [[float(bin_x), float(bin_acc)] for bin_x, bin_acc in zip(bins, bin_accs) if not np.isnan(bin_acc)]
+            table = wandb.Table(data=data, columns=[x_name, y_name])
+            plots[y_name] = wandb.plot.line(table, x_name, y_name, title=y_name)
 
+        plots = {}
         for prefix in bin_totals.keys():
             prefixes = [preprefix, prefix]
 
@@ -248,6 +325,8 @@ def test(args: TrainConfig, accelerator: Accelerator, model, tokenizer, preprefi
             # Plot bin accuracies
             plot_bins(bin_totals[prefix], bin_counts[prefix], bins, "acc_over_time", "bin_time", prefixes)
 
+        wandb.log(plots)
+
         averager.update({"time": time.time() - start_time})
         averaged_stats = averager.average()
         averaged_stats = add_prefix(preprefix, averaged_stats)
@@ -275,12 +354,13 @@ def main(args: TrainConfig):
         }
     )
 
-    model, tokenizer = load_model(args.checkpoint_path, args, "cuda")
-    model.eval()
+    model, tokenizer = load_model(args.checkpoint_path, args)
 
     # noinspection PyTypeChecker
     model = accelerator.prepare(model)
 
+    setup_args(args)
+
     args.data.sample_weights_path = "../../../datasets/rhythm_complexities.csv"
     test(args, accelerator, model, tokenizer, "test_noise")
 
@@ -11,6 +11,25 @@ import time
 from pathlib import Path
 from typing import Optional
 
+# 可选的异步HTTP客户端，进度监控在一个长连接上异步轮询
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# 可选的流式multipart编码，上传大音频文件时不把整个文件读入内存
+try:
+    from requests_toolbelt import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
+
+# 进度轮询的退避间隔（秒）：无变化时从基础间隔逐次翻倍，进度变化后重置
+PROGRESS_POLL_BASE = 0.5
+PROGRESS_POLL_CAP = 5.0
+
+# 下载结果时每次写入磁盘的块大小
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
 class MapperatorinatorProgressClient:
     """支持进度监控的Mapperatorinator API客户端"""
     
@@ -30,13 +49,18 @@ class MapperatorinatorProgressClient:
         response.raise_for_status()
         return response.json()
     
+    async def _get_progress(self, client, job_id: str) -> dict:
+        """异步获取详细进度信息"""
+        response = await client.get(f"{self.base_url}/jobs/{job_id}/progress")
+        response.raise_for_status()
+        return response.json()
+    
     def start_job(self, audio_file_path: str, **params) -> str:
         """启动处理任务"""
         file_path = Path(audio_file_path)
         if not file_path.exists():
             raise FileNotFoundError(f"音频文件不存在: {audio_file_path}")
         
-        files = {'audio_file': (file_path.name, open(file_path, 'rb'))}
         data = {
             'model': params.get('model', 'v30'),
             'gamemode': params.get('gamemode', 0),
@@ -49,43 +73,78 @@ class MapperatorinatorProgressClient:
             if key not in data and value is not None:
                 data[key] = value
         
-        try:
-            response = self.session.post(f"{self.base_url}/process", files=files, data=data)
-            response.raise_for_status()
-            result = response.json()
-            return result['job_id']
-        finally:
-            files['audio_file'][1].close()
+        with open(file_path, 'rb') as audio:
+            if MultipartEncoder is not None:
+                # 边读边发送文件内容
+                encoder = MultipartEncoder(fields={
+                    **{key: str(value) for key, value in data.items()},
+                    'audio_file': (file_path.name, audio, 'application/octet-stream')
+                })
+                response = self.session.post(
+                    f"{self.base_url}/process",
+                    data=encoder,
+                    headers={'Content-Type': encoder.content_type}
+                )
+            else:
+                response = self.session.post(
+                    f"{self.base_url}/process",
+                    files={'audio_file': (file_path.name, audio)},
+                    data=data
+                )
+        response.raise_for_status()
+        result = response.json()
+        return result['job_id']
     
-    def monitor_progress(self, job_id: str, callback=None, update_interval: float = 2.0):
+    async def monitor_progress(self, job_id: str, callback=None, update_interval: float = PROGRESS_POLL_CAP):
         """
         监控任务进度
         
         Args:
             job_id: 任务ID
             callback: 进度更新回调函数 callback(progress_info)
-            update_interval: 更新间隔（秒）
+            update_interval: 最大更新间隔（秒），进度无变化时轮询间隔逐步退避到该值
         """
         print(f"📊 开始监控任务: {job_id}")
         
+        if httpx is None:
+            # 没有安装httpx时，在线程中使用requests会话轮询，退避策略相同
+            async def fetch_progress():
+                return await asyncio.to_thread(self.get_progress, job_id)
+            
+            await self._poll_progress(fetch_progress, requests.exceptions.RequestException, callback, update_interval)
+            return
+        
+        limits = httpx.Limits(max_keepalive_connections=1, keepalive_expiry=60)
+        async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+            async def fetch_progress():
+                return await self._get_progress(client, job_id)
+            
+            await self._poll_progress(fetch_progress, httpx.HTTPError, callback, update_interval)
+    
+    async def _poll_progress(self, fetch_progress, request_errors, callback, update_interval: float):
+        """轮询进度直到任务结束；进度无变化或查询失败时间隔翻倍（不超过update_interval），进度变化后重置"""
         last_progress = -1
+        interval = PROGRESS_POLL_BASE
         start_time = time.time()
         
         while True:
             try:
                 # 获取进度信息
-                progress_info = self.get_progress(job_id)
+                progress_info = await fetch_progress()
                 current_progress = progress_info['progress']
                 status = progress_info['status']
                 stage = progress_info['stage']
                 estimated = progress_info['estimated']
                 
-                # 如果进度有变化，打印更新
+                # 如果进度有变化，打印更新并重置退避
                 if current_progress != last_progress:
                     elapsed = time.time() - start_time
                     estimated_text = " (估算)" if estimated else ""
                     print(f"⏱️  {elapsed:.1f}s | 📈 {current_progress:.1f}%{estimated_text} | 🔧 {stage}")
                     last_progress = current_progress
+                    interval = PROGRESS_POLL_BASE
+                else:
+                    interval = min(update_interval, interval * 2)
                 
                 # 调用回调函数
                 if callback:
@@ -99,34 +158,39 @@ class MapperatorinatorProgressClient:
                         print(f"❌ 任务失败")
                     break
                 
-                time.sleep(update_interval)
-                
-            except requests.exceptions.RequestException as e:
+            except request_errors as e:
                 print(f"❌ 查询进度失败: {e}")
-                time.sleep(update_interval)
-            except KeyboardInterrupt:
-                print("\n⚠️ 用户中断监控")
-                break
+                interval = min(update_interval, interval * 2)
+            
+            await asyncio.sleep(min(update_interval, interval))
+    
+    def monitor_progress_sync(self, *args, **kwargs):
+        """同步调用monitor_progress，供命令行和同步流程使用"""
+        try:
+            asyncio.run(self.monitor_progress(*args, **kwargs))
+        except KeyboardInterrupt:
+            print("\n⚠️ 用户中断监控")
     
     def download_result(self, job_id: str, output_dir: str = "downloads") -> Optional[str]:
         """下载结果文件"""
         try:
-            response = self.session.get(f"{self.base_url}/jobs/{job_id}/download")
-            response.raise_for_status()
-            
-            # 获取文件名
-            filename = f"{job_id}_result.osz"
-            if 'content-disposition' in response.headers:
-                content_disposition = response.headers['content-disposition']
-                if 'filename=' in content_disposition:
-                    filename = content_disposition.split('filename=')[1].strip('"')
-            
-            # 保存文件
-            output_path = Path(output_dir) / filename
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            with open(output_path, 'wb') as f:
-                f.write(response.content)
+            with self.session.get(f"{self.base_url}/jobs/{job_id}/download", stream=True) as response:
+                response.raise_for_status()
+                
+                # 获取文件名
+                filename = f"{job_id}_result.osz"
+                if 'content-disposition' in response.headers:
+                    content_disposition = response.headers['content-disposition']
+                    if 'filename=' in content_disposition:
+                        filename = content_disposition.split('filename=')[1].strip('"')
+                
+                # 边下载边写入文件
+                output_path = Path(output_dir) / filename
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+                
+                with open(output_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
             
             return str(output_path)
         except Exception as e:
@@ -155,7 +219,7 @@ class MapperatorinatorProgressClient:
                 pass
             
             # 监控进度
-            self.monitor_progress(job_id, progress_callback)
+            self.monitor_progress_sync(job_id, progress_callback)
             
             # 下载结果
             print("\n📥 下载结果文件...")
@@ -180,7 +244,7 @@ def main():
     parser.add_argument("--gamemode", type=int, default=0, help="游戏模式")
     parser.add_argument("--difficulty", type=float, default=5.0, help="目标难度")
     parser.add_argument("--monitor-only", help="仅监控指定任务ID的进度")
-    parser.add_argument("--update-interval", type=float, default=2.0, help="进度更新间隔（秒）")
+    parser.add_argument("--update-interval", type=float, default=PROGRESS_POLL_CAP, help="最大进度更新间隔（秒）")
     
     args = parser.parse_args()
     
@@ -189,7 +253,7 @@ def main():
     if args.monitor_only:
         # 仅监控现有任务
         print(f"📊 监控现有任务: {args.monitor_only}")
-        client.monitor_progress(args.monitor_only, update_interval=args.update_interval)
+        client.monitor_progress_sync(args.monitor_only, update_interval=args.update_interval)
     else:
         # 启动新任务并监控
         params = {
@@ -5,17 +5,46 @@
 
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import requests
 
+# 可选的流式multipart编码，上传大文件时不把整个文件读入内存
+try:
+    from requests_toolbelt import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
+
+# 下载文件时每次写入磁盘的块大小
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
 
 class SimpleMapperatorinatorClient:
     """简单的 Mapperatorinator API 客户端"""
     
     def __init__(self, base_url: str = "http://127.0.0.1:8000"):
         self.base_url = base_url.rstrip('/')
+        # 所有请求共享同一个会话，复用HTTP长连接（批量生成时多线程共用）
+        self.session = requests.Session()
         print(f"🎮 连接到 Mapperatorinator API: {self.base_url}")
     
+    def _upload_file(self, endpoint: str, file_path: str) -> requests.Response:
+        """以multipart表单字段file上传文件"""
+        path = Path(file_path)
+        with open(path, 'rb') as f:
+            if MultipartEncoder is not None:
+                # 边读边发送文件内容
+                encoder = MultipartEncoder(fields={'file': (path.name, f, 'application/octet-stream')})
+                response = self.session.post(
+                    f"{self.base_url}{endpoint}",
+                    data=encoder,
+                    headers={'Content-Type': encoder.content_type}
+                )
+            else:
+                response = self.session.post(f"{self.base_url}{endpoint}", files={'file': f})
+        response.raise_for_status()
+        return response
+    
     def upload_audio(self, audio_file_path: str) -> str:
         """上传音频文件，返回服务器上的文件路径"""
         print(f"🎵 上传音频文件: {audio_file_path}")
@@ -23,11 +52,7 @@ class SimpleMapperatorinatorClient:
         if not Path(audio_file_path).exists():
             raise FileNotFoundError(f"音频文件不存在: {audio_file_path}")
         
-        with open(audio_file_path, 'rb') as f:
-            files = {'file': f}
-            response = requests.post(f"{self.base_url}/upload/audio", files=files)
-            response.raise_for_status()
-            
+        response = self._upload_file("/upload/audio", audio_file_path)
         result = response.json()
         print(f"✅ 音频上传成功: {result['filename']}")
         return result['path']
@@ -39,11 +64,7 @@ class SimpleMapperatorinatorClient:
         if not Path(beatmap_file_path).exists():
             raise FileNotFoundError(f"Beatmap文件不存在: {beatmap_file_path}")
         
-        with open(beatmap_file_path, 'rb') as f:
-            files = {'file': f}
-            response = requests.post(f"{self.base_url}/upload/beatmap", files=files)
-            response.raise_for_status()
-            
+        response = self._upload_file("/upload/beatmap", beatmap_file_path)
         result = response.json()
         print(f"✅ Beatmap上传成功: {result['filename']}")
         return result['path']
@@ -63,7 +84,7 @@ class SimpleMapperatorinatorClient:
         
         print(f"📋 推理参数: {json.dumps(inference_params, indent=2, ensure_ascii=False)}")
         
-        response = requests.post(f"{self.base_url}/inference", json=inference_params)
+        response = self.session.post(f"{self.base_url}/inference", json=inference_params)
         response.raise_for_status()
         
         result = response.json()
@@ -86,7 +107,7 @@ class SimpleMapperatorinatorClient:
     
     def get_job_status(self, job_id: str) -> dict:
         """获取任务状态"""
-        response = requests.get(f"{self.base_url}/jobs/{job_id}/status")
+        response = self.session.get(f"{self.base_url}/jobs/{job_id}/status")
         response.raise_for_status()
         return response.json()
     
@@ -108,9 +129,6 @@ class SimpleMapperatorinatorClient:
         osz_filename = osz_files[0]
         print(f"📦 下载文件: {osz_filename}")
         
-        response = requests.get(f"{self.base_url}/jobs/{job_id}/download")
-        response.raise_for_status()
-        
         # 保存文件
         save_path_obj = Path(save_path)
         if save_path_obj.is_dir():
@@ -118,15 +136,25 @@ class SimpleMapperatorinatorClient:
         else:
             final_path = save_path_obj
         
-        with open(final_path, 'wb') as f:
-            f.write(response.content)
+        # 边下载边写入文件
+        with self.session.get(f"{self.base_url}/jobs/{job_id}/download", stream=True) as response:
+            response.raise_for_status()
+            with open(final_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
         
         print(f"✅ 文件已保存到: {final_path}")
         return str(final_path)
     
+    def submit_and_wait(self, audio_path: str, config: dict) -> tuple:
+        """启动一个推理任务并等待完成，返回 (任务ID, 最终状态)"""
+        print(f"🚀 启动 {config['version']} 难度生成...")
+        job_id = self.start_inference(audio_path=audio_path, export_osz=True, **config)
+        return job_id, self.wait_for_completion(job_id)
+    
     def get_output_files(self, job_id: str) -> list:
         """获取任务输出的所有文件列表"""
-        response = requests.get(f"{self.base_url}/jobs/{job_id}/files")
+        response = self.session.get(f"{self.base_url}/jobs/{job_id}/files")
         response.raise_for_status()
         return response.json()['files']
 
@@ -240,29 +268,28 @@ def example_batch_generation():
         {"difficulty": 7.5, "gamemode": 0, "version": "Insane"},
     ]
     
-    jobs = []
-    
     try:
-        # 启动多个任务
-        for config in difficulty_configs:
-            print(f"🚀 启动 {config['version']} 难度生成...")
-            job_id = client.start_inference(
-                audio_path=audio_path,
-                export_osz=True,
-                **config
-            )
-            jobs.append((job_id, config['version']))
-        
-        # 等待所有任务完成
-        for job_id, version in jobs:
-            print(f"⏳ 等待 {version} 完成...")
-            status = client.wait_for_completion(job_id)
+        # 同时启动所有任务并并行等待，先完成的先下载
+        with ThreadPoolExecutor(max_workers=len(difficulty_configs)) as executor:
+            futures = {
+                executor.submit(client.submit_and_wait, audio_path, config): config['version']
+                for config in difficulty_configs
+            }
             
-            if status['status'] == 'completed':
-                osz_file = client.download_osz(job_id, f"./downloads/{version}_")
-                print(f"✅ {version} 完成: {osz_file}")
-            else:
-                print(f"❌ {version} 失败: {status.get('error')}")
+            for future in as_completed(futures):
+                version = futures[future]
+                
+                # 单个难度出错不影响其余难度的等待和下载
+                try:
+                    job_id, status = future.result()
+                    
+                    if status['status'] == 'completed':
+                        osz_file = client.download_osz(job_id, f"./downloads/{version}_")
+                        print(f"✅ {version} 完成: {osz_file}")
+                    else:
+                        print(f"❌ {version} 失败: {status.get('error')}")
+                except Exception as e:
+                    print(f"💥 {version} 出错: {e}")
                 
     except Exception as e:
         print(f"💥 错误: {e}")
@@ -15,7 +15,7 @@ echo 检查依赖包...
 python -c "import fastapi, uvicorn, sse_starlette" >nul 2>&1
 if %errorlevel% neq 0 (
     echo 安装缺少的依赖包...
-    pip install fastapi uvicorn sse-starlette
+    pip install fastapi "uvicorn[standard]" sse-starlette
     if %errorlevel% neq 0 (
         echo 错误: 依赖包安装失败
         pause
@@ -21,7 +21,7 @@ echo "检查依赖包..."
 $PYTHON -c "import fastapi, uvicorn, sse_starlette" 2>/dev/null
 if [ $? -ne 0 ]; then
     echo "安装缺少的依赖包..."
-    $PYTHON -m pip install fastapi uvicorn sse-starlette
+    $PYTHON -m pip install fastapi "uvicorn[standard]" sse-starlette
     if [ $? -ne 0 ]; then
         echo "错误: 依赖包安装失败"
         exit 1
@@ -3,11 +3,33 @@
 简单的API测试客户端
 """
 
-import requests
-import json
-import time
+import atexit
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from api_test_session import SESSION, load_json
+
+# 所有测试共用一个假音频文件，按进程区分文件名，退出时删除
+TEST_FILE = Path(tempfile.gettempdir()) / f"test_audio_{os.getpid()}.mp3"
+TEST_FILE.write_bytes(b"fake audio content for testing")
+atexit.register(TEST_FILE.unlink, missing_ok=True)
+
+# 可选的流式multipart编码，上传时边读文件边发送
+try:
+    from requests_toolbelt import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
+
+def post_process(base_url, files, data):
+    """提交/process请求，安装了requests_toolbelt时以流式multipart上传音频"""
+    if MultipartEncoder is None:
+        return SESSION.post(f"{base_url}/process", files=files, data=data)
+    
+    encoder = MultipartEncoder(fields={**{key: str(value) for key, value in data.items()}, **files})
+    return SESSION.post(f"{base_url}/process", data=encoder, headers={'Content-Type': encoder.content_type})
+
 def test_api():
     """测试API基本功能"""
     base_url = "http://127.0.0.1:8000"
@@ -18,10 +40,10 @@ def test_api():
     # 1. 测试根端点
     print("1️⃣ 测试根端点...")
     try:
-        response = requests.get(f"{base_url}/")
+        response = SESSION.get(f"{base_url}/")
         if response.status_code == 200:
             print("✅ 根端点正常")
-            data = response.json()
+            data = load_json(response)
             print(f"   版本: {data.get('message', 'Unknown')}")
         else:
             print(f"❌ 根端点错误: {response.status_code}")
@@ -34,16 +56,7 @@ def test_api():
     # 2. 测试处理端点（模拟请求，不需要真实音频文件）
     print("\n2️⃣ 测试处理端点参数验证...")
     
-    # 创建一个临时的测试文件
-    test_file_path = Path("test_audio.mp3")
-    if not test_file_path.exists():
-        # 创建一个假的音频文件用于测试
-        with open(test_file_path, 'wb') as f:
-            f.write(b"fake audio content for testing")
-        print(f"   创建测试文件: {test_file_path}")
-    
     try:
-        files = {'audio_file': ('test.mp3', open(test_file_path, 'rb'), 'audio/mpeg')}
         data = {
             'model': 'default',
             'gamemode': 0,
@@ -57,36 +70,38 @@ def test_api():
             'negative_descriptors': ''  # 空字符串
         }
         
-        response = requests.post(f"{base_url}/process", files=files, data=data)
+        with open(TEST_FILE, 'rb') as audio:
+            files = {'audio_file': ('test.mp3', audio, 'audio/mpeg')}
+            response = post_process(base_url, files, data)
         
         if response.status_code == 200:
-            result = response.json()
+            result = load_json(response)
             job_id = result.get('job_id')
             print(f"✅ 处理请求成功，任务ID: {job_id}")
             
             # 3. 测试状态查询
             print(f"\n3️⃣ 测试状态查询...")
-            status_response = requests.get(f"{base_url}/jobs/{job_id}/status")
+            status_response = SESSION.get(f"{base_url}/jobs/{job_id}/status")
             if status_response.status_code == 200:
-                status = status_response.json()
+                status = load_json(status_response)
                 print(f"✅ 状态查询成功: {status['status']}")
             else:
                 print(f"❌ 状态查询失败: {status_response.status_code}")
             
             # 4. 测试任务列表
             print(f"\n4️⃣ 测试任务列表...")
-            jobs_response = requests.get(f"{base_url}/jobs")
+            jobs_response = SESSION.get(f"{base_url}/jobs")
             if jobs_response.status_code == 200:
-                jobs = jobs_response.json()
+                jobs = load_json(jobs_response)
                 print(f"✅ 任务列表查询成功，当前任务数: {len(jobs.get('jobs', []))}")
             else:
                 print(f"❌ 任务列表查询失败: {jobs_response.status_code}")
             
             # 5. 测试取消任务
             print(f"\n5️⃣ 测试取消任务...")
-            cancel_response = requests.post(f"{base_url}/jobs/{job_id}/cancel")
+            cancel_response = SESSION.post(f"{base_url}/jobs/{job_id}/cancel")
             if cancel_response.status_code == 200:
-                cancel_result = cancel_response.json()
+                cancel_result = load_json(cancel_response)
                 print(f"✅ 任务取消成功: {cancel_result.get('message', 'Unknown')}")
             else:
                 print(f"❌ 任务取消失败: {cancel_response.status_code}")
@@ -103,11 +118,6 @@ def test_api():
     except Exception as e:
         print(f"❌ 测试处理端点失败: {e}")
         return False
-    finally:
-        # 清理测试文件
-        if test_file_path.exists():
-            test_file_path.unlink()
-            print(f"   清理测试文件: {test_file_path}")
     
     print("\n🎉 API测试完成!")
     return True
@@ -117,11 +127,6 @@ def test_json_params():
     print("\n📋 测试JSON参数处理...")
     
     base_url = "http://127.0.0.1:8000"
-    test_file_path = Path("test_audio.mp3")
-    
-    # 创建测试文件
-    with open(test_file_path, 'wb') as f:
-        f.write(b"fake audio content for testing")
     
     test_cases = [
         ("空字符串", ""),
@@ -131,35 +136,41 @@ def test_json_params():
         ("null值", "null")
     ]
     
-    try:
-        for desc, json_str in test_cases:
-            print(f"   测试 {desc}: {json_str}")
-            
-            files = {'audio_file': ('test.mp3', open(test_file_path, 'rb'), 'audio/mpeg')}
-            data = {
-                'model': 'default',
-                'descriptors': json_str
-            }
-            
-            response = requests.post(f"{base_url}/process", files=files, data=data)
-            files['audio_file'][1].close()
-            
-            if response.status_code == 200:
-                result = response.json()
-                job_id = result.get('job_id')
-                print(f"     ✅ 成功，任务ID: {job_id}")
-                
-                # 立即取消任务
-                requests.post(f"{base_url}/jobs/{job_id}/cancel")
-            else:
-                error_data = response.json()
-                print(f"     ❌ 失败: {error_data.get('detail', 'Unknown error')}")
+    def submit_case(json_str):
+        """提交一个测试用例，返回响应以及成功时解析出的结果"""
+        data = {
+            'model': 'default',
+            'descriptors': json_str
+        }
+        
+        with open(TEST_FILE, 'rb') as audio:
+            files = {'audio_file': ('test.mp3', audio, 'audio/mpeg')}
+            response = post_process(base_url, files, data)
+        
+        result = load_json(response) if response.status_code == 200 else None
+        return response, result
     
-    finally:
-        if test_file_path.exists():
-            test_file_path.unlink()
+    def cancel_job(job_id):
+        return SESSION.post(f"{base_url}/jobs/{job_id}/cancel")
+    
+    # 先并行提交全部用例，再并行取消已创建的任务，按原顺序输出结果
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        outcomes = list(executor.map(submit_case, [json_str for _, json_str in test_cases]))
+        job_ids = [result.get('job_id') for _, result in outcomes if result is not None]
+        list(executor.map(cancel_job, job_ids))
+    
+    for (desc, json_str), (response, result) in zip(test_cases, outcomes):
+        print(f"   测试 {desc}: {json_str}")
+        
+        if response.status_code == 200:
+            job_id = result.get('job_id')
+            print(f"     ✅ 成功，任务ID: {job_id}")
+        else:
+            error_data = response.json()
+            print(f"     ❌ 失败: {error_data.get('detail', 'Unknown error')}")
 
 if __name__ == "__main__":
-    if test_api():
-        test_json_params()
-    print("\n✨ 测试完成!")
+    with SESSION:
+        if test_api():
+            test_json_params()
+        print("\n✨ 测试完成!")
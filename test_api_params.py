@@ -3,9 +3,9 @@
 测试API参数处理的简单脚本
 """
 
-import requests
 import json
-from pathlib import Path
+
+from api_test_session import SESSION, load_json
 
 def test_api_with_form_data():
     """测试API表单数据处理"""
@@ -13,14 +13,8 @@ def test_api_with_form_data():
     
     print("🧪 测试API参数处理...")
     
-    # 创建测试音频文件
-    test_file_path = Path("test_audio.mp3")
-    with open(test_file_path, 'wb') as f:
-        f.write(b"fake audio content for testing")
-    
     try:
         # 模拟HTML表单提交的数据 (包含空字符串)
-        files = {'audio_file': ('test.mp3', open(test_file_path, 'rb'), 'audio/mpeg')}
         data = {
             'model': 'v30',
             'gamemode': '0',
@@ -51,18 +45,11 @@ def test_api_with_form_data():
         }
         
         print("📤 发送请求...")
-        response = requests.post(f"{base_url}/process", files=files, data=data)
+        # 只校验参数解析，不上传音频也不创建任务
+        response = SESSION.post(f"{base_url}/process/validate", data=data)
         
         if response.status_code == 200:
-            result = response.json()
-            job_id = result.get('job_id')
-            print(f"✅ 请求成功！任务ID: {job_id}")
-            
-            # 立即取消任务
-            cancel_response = requests.post(f"{base_url}/jobs/{job_id}/cancel")
-            if cancel_response.status_code == 200:
-                print("✅ 任务已取消")
-            
+            print("✅ 请求成功！参数解析正常")
             return True
         else:
             print(f"❌ 请求失败: {response.status_code}")
@@ -76,10 +63,6 @@ def test_api_with_form_data():
     except Exception as e:
         print(f"❌ 测试失败: {e}")
         return False
-    finally:
-        files['audio_file'][1].close()
-        if test_file_path.exists():
-            test_file_path.unlink()
 
 def test_api_with_descriptors():
     """测试带描述符的请求"""
@@ -87,12 +70,7 @@ def test_api_with_descriptors():
     
     print("\n🎨 测试描述符处理...")
     
-    test_file_path = Path("test_audio.mp3")
-    with open(test_file_path, 'wb') as f:
-        f.write(b"fake audio content for testing")
-    
     try:
-        files = {'audio_file': ('test.mp3', open(test_file_path, 'rb'), 'audio/mpeg')}
         data = {
             'model': 'v30',
             'gamemode': '0',
@@ -104,15 +82,11 @@ def test_api_with_descriptors():
             'seed': '12345'  # 有效的seed
         }
         
-        response = requests.post(f"{base_url}/process", files=files, data=data)
+        response = SESSION.post(f"{base_url}/process/validate", data=data)
         
         if response.status_code == 200:
-            result = response.json()
-            job_id = result.get('job_id')
-            print(f"✅ 描述符请求成功！任务ID: {job_id}")
-            
-            # 取消任务
-            requests.post(f"{base_url}/jobs/{job_id}/cancel")
+            params = load_json(response)['params']
+            print(f"✅ 描述符请求成功！描述符: {params['descriptors']}，负面描述符: {params['negative_descriptors']}")
             return True
         else:
             print(f"❌ 描述符请求失败: {response.status_code}")
@@ -126,31 +100,28 @@ def test_api_with_descriptors():
     except Exception as e:
         print(f"❌ 描述符测试失败: {e}")
         return False
-    finally:
-        files['audio_file'][1].close()
-        if test_file_path.exists():
-            test_file_path.unlink()
 
 if __name__ == "__main__":
-    print("🎮 Mapperatorinator API参数测试")
-    print("=" * 40)
+    with SESSION:
+        print("🎮 Mapperatorinator API参数测试")
+        print("=" * 40)
     
-    # 检查API是否运行
-    try:
-        response = requests.get("http://127.0.0.1:8000/")
-        if response.status_code != 200:
-            print("❌ API服务器未运行，请先启动: python api_v2.py")
+        # 检查API是否运行
+        try:
+            response = SESSION.get("http://127.0.0.1:8000/")
+            if response.status_code != 200:
+                print("❌ API服务器未运行，请先启动: python api_v2.py")
+                exit(1)
+            print("✅ API服务器运行正常")
+        except:
+            print("❌ 无法连接API服务器，请先启动: python api_v2.py")
             exit(1)
-        print("✅ API服务器运行正常")
-    except:
-        print("❌ 无法连接API服务器，请先启动: python api_v2.py")
-        exit(1)
     
-    # 运行测试
-    test1 = test_api_with_form_data()
-    test2 = test_api_with_descriptors()
+        # 运行测试
+        test1 = test_api_with_form_data()
+        test2 = test_api_with_descriptors()
     
-    if test1 and test2:
-        print("\n🎉 所有测试通过！")
-    else:
-        print("\n💥 部分测试失败")
+        if test1 and test2:
+            print("\n🎉 所有测试通过！")
+        else:
+            print("\n💥 部分测试失败")
@@ -4,8 +4,9 @@
 """
 
 import requests
-import time
-import json
+from concurrent.futures import ThreadPoolExecutor
+
+from api_test_session import SESSION, load_json
 
 def test_api_endpoints():
     """测试API端点"""
@@ -16,10 +17,10 @@ def test_api_endpoints():
     
     # 测试根端点
     try:
-        response = requests.get(f"{base_url}/")
+        response = SESSION.get(f"{base_url}/")
         if response.status_code == 200:
             print("✅ 根端点正常")
-            data = response.json()
+            data = load_json(response)
             print(f"   API版本: {data.get('message', 'Unknown')}")
         else:
             print("❌ 根端点失败")
@@ -39,8 +40,15 @@ def test_api_endpoints():
     # 创建一个不存在的job_id来测试404响应
     fake_job_id = "test-fake-job-12345"
     
+    # 以下探测请求互不依赖，并行发送
+    probe_paths = [f"/jobs/{fake_job_id}/status", f"/jobs/{fake_job_id}/progress", "/jobs"]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        status_future, progress_future, jobs_future = [
+            executor.submit(SESSION.get, f"{base_url}{path}") for path in probe_paths
+        ]
+    
     try:
-        response = requests.get(f"{base_url}/jobs/{fake_job_id}/status")
+        response = status_future.result()
         if response.status_code == 404:
             print("✅ 不存在任务的404响应正常")
         else:
@@ -50,7 +58,7 @@ def test_api_endpoints():
     
     # 测试进度端点
     try:
-        response = requests.get(f"{base_url}/jobs/{fake_job_id}/progress")
+        response = progress_future.result()
         if response.status_code == 404:
             print("✅ 不存在任务的进度端点404响应正常")
         else:
@@ -60,10 +68,10 @@ def test_api_endpoints():
     
     # 测试作业列表端点
     try:
-        response = requests.get(f"{base_url}/jobs")
+        response = jobs_future.result()
         if response.status_code == 200:
             print("✅ 作业列表端点正常")
-            data = response.json()
+            data = load_json(response)
             print(f"   当前活动任务数: {len(data.get('jobs', []))}")
         else:
             print(f"❌ 作业列表端点失败: {response.status_code}")
@@ -89,4 +97,5 @@ def test_api_endpoints():
     return True
 
 if __name__ == "__main__":
-    test_api_endpoints()
+    with SESSION:
+        test_api_endpoints()
@@ -5,10 +5,20 @@
 
 import sys
 import os
+import timeit
+
+import numpy as np
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from api_v2 import parse_progress_from_output, estimate_progress_from_stage
 
+def report_table(lines, results, expected):
+    """整表比较结果，只逐条打印失败的用例"""
+    passed = results == expected
+    report = [f"  {int(passed.sum())}/{len(passed)} 通过"]
+    report.extend(f"  ❌ Test {i + 1}: '{lines[i]}' -> {results[i]} (期望: {expected[i]})" for i in np.flatnonzero(~passed))
+    print(*report, sep='\n')
+
 def test_progress_parsing():
     """测试进度解析功能"""
     print("🧪 测试进度解析功能")
@@ -31,10 +41,10 @@ def test_progress_parsing():
     ]
     
     print("📊 进度百分比解析测试:")
-    for i, (line, expected) in enumerate(test_cases, 1):
-        result = parse_progress_from_output(line)
-        status = "✅" if result == expected else "❌"
-        print(f"  {status} Test {i}: '{line}' -> {result} (期望: {expected})")
+    lines = [line for line, _ in test_cases]
+    results = np.fromiter((parse_progress_from_output(line) for line in lines), dtype=object, count=len(lines))
+    expected = np.fromiter((value for _, value in test_cases), dtype=object, count=len(test_cases))
+    report_table(lines, results, expected)
     
     print("\n📋 阶段识别测试:")
     stage_test_cases = [
@@ -47,11 +57,14 @@ def test_progress_parsing():
         ("Unknown operation", None),
     ]
     
-    for i, (line, expected_stage) in enumerate(stage_test_cases, 1):
+    def detect_stage(line):
         result = estimate_progress_from_stage(line, 50.0)  # 假设当前进度50%
-        stage = result['stage'] if result else None
-        status = "✅" if stage == expected_stage else "❌"
-        print(f"  {status} Test {i}: '{line}' -> {stage} (期望: {expected_stage})")
+        return result['stage'] if result else None
+    
+    lines = [line for line, _ in stage_test_cases]
+    results = np.fromiter((detect_stage(line) for line in lines), dtype=object, count=len(lines))
+    expected = np.fromiter((stage for _, stage in stage_test_cases), dtype=object, count=len(stage_test_cases))
+    report_table(lines, results, expected)
     
     print("\n🎯 综合测试:")
     # 模拟真实的推理输出序列
@@ -69,6 +82,8 @@ def test_progress_parsing():
         "Generated beatmap saved to outputs/test_beatmap.osu"
     ]
     
+    # 输出先收集起来，循环结束后一次写出
+    steps = []
     current_progress = 0.0
     for i, line in enumerate(real_output_sequence, 1):
         # 模拟API中的处理逻辑
@@ -85,7 +100,18 @@ def test_progress_parsing():
                 estimated = True
         
         progress_type = "精确" if not estimated else "估算"
-        print(f"  Step {i:2d}: {current_progress:5.1f}% ({progress_type}) - {line[:50]}...")
+        steps.append(f"  Step {i:2d}: {current_progress:5.1f}% ({progress_type}) - {line[:50]}...")
+    print(*steps, sep='\n')
+    
+    print("\n⏱️ 解析性能:")
+    def parse_sequence():
+        for line in real_output_sequence:
+            if parse_progress_from_output(line) is None:
+                estimate_progress_from_stage(line, 50.0)
+    
+    number = 1000
+    best = min(timeit.repeat(parse_sequence, number=number, repeat=5))
+    print(f"  每行平均 {best / number / len(real_output_sequence) * 1e6:.2f} µs ({len(real_output_sequence)} 行 × {number} 次，取5轮最佳)")
 
 if __name__ == "__main__":
     test_progress_parsing()